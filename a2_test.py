@@ -23,13 +23,29 @@ NOTES:
       Please do your testing there - otherwise,
       you might get inaccurate test failures!
 """
+import json
 import os
+import random
+import sys
+import tempfile
 
 import unittest
 from hypothesis import given
 from hypothesis.strategies import integers
 
-from tree_data import FileSystemTree
+import instrumentation
+from export import export_treemap, iter_treemap, read_binary
+from layout import TreemapView
+from shard import merge_shards, scan_shard, scan_shards_locally
+from snapshot import SnapshotTree, load_snapshot, save_snapshot, \
+    tree_records
+from spill import SpillingFileSystemTree
+from tree_data import AbstractTree, FileSystemTree
+from tiles import TileCache, TileRenderer
+from tree_builder import import_du, import_json, import_listing
+from tree_diff import diff_trees
+from treemap_visualiser import rect_to_leaf
+from watcher import TreeWatcher
 
 
 # This should be the path to the "B" folder in the sample data.
@@ -136,5 +152,632 @@ class GenerateTreemapTest(unittest.TestCase):
         self.assertEqual(rect_f1, (399, 250, 401, 750))
 
 
+
+class DeepTreeTest(unittest.TestCase):
+    def test_deep_generate_treemap(self):
+        tree = AbstractTree('f1', [], 10)
+        for _ in range(10000):
+            tree = AbstractTree('F', [tree])
+        rects = tree.generate_treemap((0, 0, 800, 1000))
+        self.assertEqual([rect for rect, _ in rects], [(0, 0, 800, 1000)])
+
+    def test_deep_file_system_tree(self):
+        # Deeper than the recursion limit; note that shutil.rmtree is itself
+        # recursive, so the folders are removed by hand.
+        root = tempfile.mkdtemp()
+        depth = sys.getrecursionlimit() + 500
+        folders = []
+        path = root
+        for _ in range(depth):
+            path = os.path.join(path, 'd')
+            os.mkdir(path)
+            folders.append(path)
+        file_path = os.path.join(path, 'f1.txt')
+        with open(file_path, 'w') as f:
+            f.write('x' * 15)
+        try:
+            tree = FileSystemTree(root)
+        finally:
+            os.remove(file_path)
+            for folder in reversed(folders):
+                os.rmdir(folder)
+            os.rmdir(root)
+
+        self.assertEqual(tree.data_size, 15)
+        leaf, text = rect_to_leaf(tree, (0, 0, 800, 1000), 10, 10, '')
+        self.assertEqual(leaf.treename(), 'f1.txt')
+        self.assertEqual(text, '/d' * depth + '/f1.txt')
+
+class FileSystemScanOptionsTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, 'A'))
+        self.f1 = os.path.join(self.root, 'A', 'f1.txt')
+        with open(self.f1, 'w') as f:
+            f.write('x' * 15)
+        os.link(self.f1, os.path.join(self.root, 'f2.txt'))
+        # A symlink pointing back up the tree.
+        os.symlink(self.root, os.path.join(self.root, 'A', 'loop'))
+
+    def tearDown(self):
+        os.remove(os.path.join(self.root, 'A', 'loop'))
+        os.remove(os.path.join(self.root, 'f2.txt'))
+        os.remove(self.f1)
+        os.rmdir(os.path.join(self.root, 'A'))
+        os.rmdir(self.root)
+
+    def test_symlink_loop_is_scanned_once(self):
+        tree = FileSystemTree(self.root)
+        self.assertEqual(tree.data_size, 30)
+        folder_a = [t for t in tree.subtrees() if t.treename() == 'A'][0]
+        self.assertEqual([t.treename() for t in folder_a.subtrees()],
+                         ['f1.txt'])
+
+    def test_no_follow_symlinks(self):
+        tree = FileSystemTree(self.root, follow_symlinks=False)
+        folder_a = [t for t in tree.subtrees() if t.treename() == 'A'][0]
+        link = [t for t in folder_a.subtrees() if t.treename() == 'loop'][0]
+        self.assertEqual(link.subtrees(), [])
+        self.assertEqual(link.data_size, len(self.root))
+
+    def test_count_links_once(self):
+        tree = FileSystemTree(self.root, count_links_once=True)
+        self.assertEqual(tree.data_size, 15)
+        # A file is only forgotten once all of its links have been found.
+        os.link(self.f1, os.path.join(self.root, 'A', 'f3.txt'))
+        try:
+            tree = FileSystemTree(self.root, count_links_once=True)
+        finally:
+            os.remove(os.path.join(self.root, 'A', 'f3.txt'))
+        self.assertEqual(tree.data_size, 15)
+
+    def test_disk_usage(self):
+        tree = FileSystemTree(self.f1, disk_usage=True)
+        self.assertEqual(tree.data_size, os.stat(self.f1).st_blocks * 512)
+
+    def test_dangling_symlink(self):
+        dangling = os.path.join(self.root, 'A', 'dangling')
+        os.symlink(os.path.join(self.root, 'missing'), dangling)
+        try:
+            tree = FileSystemTree(self.root)
+        finally:
+            os.remove(dangling)
+        folder_a = [t for t in tree.subtrees() if t.treename() == 'A'][0]
+        self.assertEqual(sorted(t.treename() for t in folder_a.subtrees()),
+                         ['dangling', 'f1.txt'])
+
+    def test_symlink_cycle(self):
+        # Links to each other, and to themselves: stat fails with ELOOP.
+        links = [os.path.join(self.root, 'A', name)
+                 for name in ('a', 'b', 'loopy')]
+        os.symlink(links[1], links[0])
+        os.symlink(links[0], links[1])
+        os.symlink(links[2], links[2])
+        try:
+            tree = FileSystemTree(self.root)
+        finally:
+            for link in links:
+                os.remove(link)
+        folder_a = [t for t in tree.subtrees() if t.treename() == 'A'][0]
+        self.assertEqual(sorted(t.treename() for t in folder_a.subtrees()),
+                         ['a', 'b', 'f1.txt', 'loopy'])
+
+    @unittest.skipIf(os.geteuid() == 0, 'root can read any folder')
+    def test_unreadable_folder_is_skipped(self):
+        locked = os.path.join(self.root, 'locked')
+        os.mkdir(locked, 0)
+        try:
+            tree = FileSystemTree(self.root)
+        finally:
+            os.rmdir(locked)
+        self.assertEqual(tree.data_size, 30)
+
+
+class FileSystemScanPruningTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.paths = []
+        for folder in ['.git', 'A', os.path.join('A', 'C')]:
+            os.mkdir(os.path.join(self.root, folder))
+            self.paths.append(os.path.join(self.root, folder))
+        for name, size in [('f1.txt', 15), ('f2.pyc', 5),
+                           (os.path.join('.git', 'HEAD'), 20),
+                           (os.path.join('A', 'f3.txt'), 10),
+                           (os.path.join('A', 'C', 'f4.txt'), 3)]:
+            path = os.path.join(self.root, name)
+            with open(path, 'w') as f:
+                f.write('x' * size)
+            self.paths.append(path)
+
+    def tearDown(self):
+        for path in reversed(self.paths):
+            if os.path.isdir(path):
+                os.rmdir(path)
+            else:
+                os.remove(path)
+        os.rmdir(self.root)
+
+    def _names(self, tree):
+        return sorted(subtree.treename() for subtree in tree.subtrees())
+
+    def test_exclude_and_include(self):
+        tree = FileSystemTree(self.root, exclude=['.git', '*.pyc'])
+        self.assertEqual(self._names(tree), ['A', 'f1.txt'])
+        self.assertEqual(tree.data_size, 28)
+        tree = FileSystemTree(self.root, include=['*.pyc'])
+        self.assertEqual(tree.data_size, 5)
+
+    def test_max_depth(self):
+        tree = FileSystemTree(self.root, max_depth=1)
+        self.assertEqual(self._names(tree), ['f1.txt', 'f2.pyc'])
+        tree = FileSystemTree(self.root, max_depth=1, collapse_pruned=True)
+        self.assertEqual(tree.data_size, 53)
+        folder_a = [t for t in tree.subtrees() if t.treename() == 'A'][0]
+        self.assertEqual(folder_a.subtrees(), [])
+        self.assertEqual(folder_a.data_size, 13)
+
+    def test_min_size(self):
+        tree = FileSystemTree(self.root, min_size=10)
+        self.assertEqual(self._names(tree), ['.git', 'A', 'f1.txt'])
+        self.assertEqual(tree.data_size, 45)
+        tree = FileSystemTree(self.root, min_size=10, collapse_pruned=True)
+        self.assertEqual(tree.data_size, 53)
+        self.assertEqual(tree.subtrees()[-1].treename(), '(other)')
+        self.assertEqual(tree.subtrees()[-1].data_size, 5)
+
+
+class SnapshotDiffTest(unittest.TestCase):
+    def _tree(self, sizes):
+        folder_a = SnapshotTree('A', [SnapshotTree(name, [], size)
+                                      for name, size in sizes])
+        return SnapshotTree('B', [SnapshotTree('f4.txt', [], 10), folder_a])
+
+    def test_snapshot_round_trip(self):
+        tree = self._tree([('f1.txt', 15), ('tab\tname', 5)])
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'B.snapshot')
+            save_snapshot(tree, path)
+            loaded = load_snapshot(path)
+        self.assertEqual(loaded.treename(), 'B')
+        self.assertEqual(loaded.data_size, 30)
+        self.assertIs(loaded.subtrees()[0].get_parent(), loaded)
+        # Subtrees are saved sorted by name.
+        self.assertEqual([t.treename() for t in loaded.subtrees()],
+                         ['A', 'f4.txt'])
+        folder_a = loaded.subtrees()[0]
+        self.assertEqual([t.treename() for t in folder_a.subtrees()],
+                         ['f1.txt', 'tab\tname'])
+
+    def test_diff(self):
+        old = self._tree([('f1.txt', 15), ('f2.txt', 5), ('f3.txt', 10)])
+        new = self._tree([('f1.txt', 20), ('f3.txt', 5), ('f5.txt', 8)])
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'old.snapshot')
+            save_snapshot(old, path)
+            for growth in [diff_trees(old, new), diff_trees(path, new)]:
+                self.assertEqual(growth.data_size, 13)
+                self.assertEqual(len(growth.subtrees()), 1)
+                folder_a = growth.subtrees()[0]
+                self.assertEqual([(t.treename(), t.data_size)
+                                  for t in folder_a.subtrees()],
+                                 [('f1.txt', 5), ('f5.txt', 8)])
+                rects = growth.generate_treemap((0, 0, 130, 10))
+                self.assertEqual([rect for rect, _ in rects],
+                                 [(0, 0, 50, 10), (50, 0, 80, 10)])
+
+
+class InstrumentationTest(unittest.TestCase):
+    def tearDown(self):
+        instrumentation.disable()
+        instrumentation.reset()
+
+    def test_disabled_records_nothing(self):
+        tree = AbstractTree('F', [AbstractTree('f1', [], 10)])
+        tree.generate_treemap((0, 0, 100, 100))
+        metrics = instrumentation.get_metrics()
+        self.assertEqual(metrics.timers, {})
+        self.assertEqual(metrics.counters, {})
+
+    def test_counters_and_listeners(self):
+        frames = []
+        instrumentation.enable()
+        instrumentation.add_listener(frames.append)
+        try:
+            tree = AbstractTree('F', [AbstractTree('f1', [], 10),
+                                      AbstractTree('f2', [], 0)])
+            tree.generate_treemap((0, 0, 100, 100))
+            instrumentation.end_frame(0.5)
+        finally:
+            instrumentation.remove_listener(frames.append)
+        metrics = instrumentation.get_metrics()
+        self.assertEqual(metrics.counters['nodes_visited'], 3)
+        self.assertEqual(metrics.calls['generate_treemap'], 1)
+        self.assertEqual(frames, [metrics])
+        self.assertEqual(metrics.frame_time, 0.5)
+
+
+class ShardTest(unittest.TestCase):
+    def test_scan_and_merge(self):
+        with tempfile.TemporaryDirectory() as folder:
+            root = os.path.join(folder, 'B')
+            os.makedirs(os.path.join(root, 'A'))
+            for name, size in [('f4.txt', 10),
+                               (os.path.join('A', 'f1.txt'), 15),
+                               (os.path.join('A', 'f2.txt'), 5)]:
+                with open(os.path.join(root, name), 'w') as f:
+                    f.write('x' * size)
+            shard_folder = os.path.join(folder, 'shards')
+            os.mkdir(shard_folder)
+            shard_paths = scan_shards_locally(root, shard_folder, processes=2)
+            tree = merge_shards(root, shard_paths)
+            scanned = FileSystemTree(root)
+
+        self.assertEqual(tree.treename(), 'B')
+        self.assertIs(tree.get_parent(), None)
+        self.assertEqual(tree.data_size, 30)
+        self.assertEqual([t.treename() for t in tree.subtrees()],
+                         [t.treename() for t in scanned.subtrees()])
+        for subtree in tree.subtrees():
+            self.assertIs(subtree.get_parent(), tree)
+
+    def test_scan_options(self):
+        with tempfile.TemporaryDirectory() as folder:
+            root = os.path.join(folder, 'B')
+            for name in ('.git', 'A', os.path.join('A', 'C')):
+                os.makedirs(os.path.join(root, name))
+            for name, size in [('f1.txt', 15), ('f2.pyc', 5),
+                               (os.path.join('.git', 'HEAD'), 20),
+                               (os.path.join('A', 'f3.pyc'), 10),
+                               (os.path.join('A', 'C', 'f4.txt'), 3)]:
+                with open(os.path.join(root, name), 'w') as f:
+                    f.write('x' * size)
+            shard_folder = os.path.join(folder, 'shards')
+            os.mkdir(shard_folder)
+            options = {'exclude': ['.git', '*.pyc'], 'max_depth': 2}
+            shard_paths = scan_shards_locally(root, shard_folder, **options)
+            tree = merge_shards(root, shard_paths)
+            scanned = FileSystemTree(root, **options)
+
+        # f1.txt and A; A/C is not opened.
+        self.assertEqual(len(shard_paths), 2)
+        self.assertEqual(list(tree_records(tree)),
+                         list(tree_records(scanned)))
+
+    def test_overlapping_shards(self):
+        with tempfile.TemporaryDirectory() as folder:
+            root = os.path.join(folder, 'B')
+            os.makedirs(os.path.join(root, 'A', 'C'))
+            shard_paths = [os.path.join(folder, name)
+                           for name in ('outer.shard', 'inner.shard')]
+            scan_shard(os.path.join(root, 'A'), shard_paths[0])
+            scan_shard(os.path.join(root, 'A', 'C'), shard_paths[1])
+            for paths in (shard_paths, shard_paths[::-1]):
+                with self.assertRaisesRegex(ValueError, 'inner.shard'):
+                    merge_shards(root, paths)
+
+
+class TileRendererTest(unittest.TestCase):
+    def test_tiles_cover_the_layout(self):
+        left = AbstractTree('f1', [], 30)
+        right = AbstractTree('f2', [], 10)
+        renderer = TileRenderer(AbstractTree('F', [left, right]), 1024, 256)
+        self.assertEqual(renderer.max_zoom, 2)
+        self.assertEqual(renderer.level_size(0), (256, 64))
+
+        # f1 covers the first 768 pixels at full size, i.e. three tiles.
+        tile = renderer.draw_tile(2, 2, 0)
+        self.assertEqual(tuple(tile.get_at((255, 100)))[:3], left.color)
+        tile = renderer.draw_tile(2, 3, 0)
+        self.assertEqual(tuple(tile.get_at((0, 0)))[:3], right.color)
+
+        image = renderer.tile(2, 3, 0)
+        self.assertIs(renderer.tile(2, 3, 0), image)
+        self.assertEqual(len(renderer.cache), 1)
+
+        # Level 2 is 4 x 1 tiles; nothing outside of them is a tile.
+        self.assertTrue(renderer.has_tile(2, 3, 0))
+        self.assertFalse(renderer.has_tile(2, 4, 0))
+        self.assertFalse(renderer.has_tile(2, 0, 1))
+        self.assertFalse(renderer.has_tile(0, 1, 0))
+
+    def test_cache_drops_least_recently_used(self):
+        cache = TileCache(10)
+        cache.put((0, 0, 0), b'1234')
+        cache.put((1, 0, 0), b'1234')
+        cache.get((0, 0, 0))
+        cache.put((1, 1, 0), b'1234')
+        self.assertIsNone(cache.get((1, 0, 0)))
+        self.assertEqual(cache.get((0, 0, 0)), b'1234')
+
+
+class TreemapViewTest(unittest.TestCase):
+    def test_rescale_without_new_layout(self):
+        leaves = [AbstractTree('f1', [], 30), AbstractTree('f2', [], 10)]
+        view = TreemapView(AbstractTree('F', leaves))
+        rects = view.rects(400, 100)
+        self.assertEqual([rect for rect, _ in rects],
+                         [(0, 0, 300, 100), (300, 0, 100, 100)])
+        layout = view._layout
+
+        # The layout is only scaled, even if the aspect ratio changes.
+        rects = view.rects(200, 300)
+        self.assertIs(view._layout, layout)
+        self.assertEqual([rect for rect, _ in rects],
+                         [(0, 0, 150, 300), (150, 0, 50, 300)])
+        self.assertEqual(view.leaf_at(160, 10)[-1], leaves[1])
+        self.assertIsNone(view.leaf_at(250, 10))
+
+        view.invalidate()
+        view.rects(200, 300)
+        self.assertIsNot(view._layout, layout)
+
+    def test_every_drawn_pixel_hits_its_leaf(self):
+        def random_tree(depth):
+            if depth == 0 or random.random() < 0.3:
+                return AbstractTree('f', [], random.randint(1, 10 ** 6))
+            return AbstractTree('F', [random_tree(depth - 1)
+                                      for _ in range(random.randint(1, 6))])
+        # A tree whose leaves used to reach a pixel past their folders.
+        random.seed(182)
+        view = TreemapView(random_tree(6))
+        for (x, y, width, height), colour in view.rects(1024, 738):
+            for corner in [(x, y), (x + width - 1, y), (x, y + height - 1),
+                           (x + width - 1, y + height - 1)]:
+                path = view.leaf_at(*corner)
+                self.assertIsNotNone(path, corner)
+                self.assertEqual(path[-1].color, colour)
+
+
+class TreeBuilderTest(unittest.TestCase):
+    def test_arrays_in_any_order(self):
+        # The children come before their parent, as in du output.
+        tree = SnapshotTree.from_arrays([2, 2, -1, 2],
+                                        ['f1', 'f2', 'F', 'f3'],
+                                        [1, 2, 4096, 3])
+        self.assertEqual(tree.treename(), 'F')
+        self.assertEqual(tree.data_size, 6)
+        self.assertEqual([t.treename() for t in tree.subtrees()],
+                         ['f1', 'f2', 'f3'])
+        self.assertTrue(all(t.get_parent() is tree for t in tree.subtrees()))
+
+    def test_importers_agree(self):
+        with tempfile.TemporaryDirectory() as folder:
+            du_path = os.path.join(folder, 'du.txt')
+            with open(du_path, 'w') as f:
+                f.write('15\tB/A/f1\n4096\tB/A\n10\tB/f4\n4096\tB\n')
+            tsv_path = os.path.join(folder, 'listing.tsv')
+            with open(tsv_path, 'w') as f:
+                f.write('path\tsize\nB/f4\t10\nB/A/f1\t15\n')
+            json_path = os.path.join(folder, 'tree.json')
+            with open(json_path, 'w') as f:
+                f.write('{"name": "B", "children": [{"name": "A", "children":'
+                        ' [{"name": "f1", "size": 15}]}, {"name": "f4",'
+                        ' "size": 10}]}')
+            trees = [import_du(du_path),
+                     import_listing(tsv_path, '\t', header=True),
+                     import_json(json_path)]
+        for tree in trees:
+            self.assertEqual(tree.treename(), 'B')
+            self.assertEqual(tree.data_size, 25)
+            self.assertEqual(sorted((t.treename(), t.data_size)
+                                    for t in tree.subtrees()),
+                             [('A', 15), ('f4', 10)])
+
+
+class SpillingScanTest(unittest.TestCase):
+    def test_budget_and_expand(self):
+        with tempfile.TemporaryDirectory() as root:
+            for i in range(10):
+                folder = os.path.join(root, 'F{}'.format(i), 'G')
+                os.makedirs(folder)
+                for j in range(10):
+                    with open(os.path.join(folder, 'f{}'.format(j)), 'w') as f:
+                        f.write('x' * (i + j))
+            full = FileSystemTree(root)
+            tree = SpillingFileSystemTree(root, max_resident_nodes=30)
+        self.assertEqual(tree.data_size, full.data_size)
+        # Only one folder of 12 nodes can be finished over the budget.
+        self.assertLess(tree.resident_nodes, 30 + 12)
+        self.assertTrue(any(subtree.is_stub() for subtree in tree.subtrees()))
+
+        stack = [tree]
+        while len(stack) != 0:
+            subtree = stack.pop()
+            subtree.expand()
+            self.assertFalse(subtree.is_stub())
+            stack.extend(subtree.subtrees())
+        self.assertEqual(list(tree_records(tree)), list(tree_records(full)))
+        tree.close()
+
+    def test_symlink_cycles(self):
+        with tempfile.TemporaryDirectory() as root:
+            for i in range(3):
+                folder = os.path.join(root, 'F{}'.format(i), 'G', 'H')
+                os.makedirs(folder)
+                with open(os.path.join(folder, 'f'), 'w') as f:
+                    f.write('x' * (i + 1))
+                # Only the folders still being scanned are remembered, but
+                # links back up the tree are still skipped.
+                os.symlink(root, os.path.join(folder, 'up'))
+                os.symlink(os.path.dirname(folder),
+                           os.path.join(folder, 'parent'))
+            full = FileSystemTree(root)
+            tree = SpillingFileSystemTree(root, max_resident_nodes=2)
+        self.assertEqual(tree.data_size, 6)
+        stack = [tree]
+        while len(stack) != 0:
+            subtree = stack.pop()
+            subtree.expand()
+            stack.extend(subtree.subtrees())
+        self.assertEqual(list(tree_records(tree)), list(tree_records(full)))
+        tree.close()
+
+    def test_large_stubs(self):
+        with tempfile.TemporaryDirectory() as root:
+            for i in range(4):
+                folder = os.path.join(root, 'F{}'.format(i))
+                os.mkdir(folder)
+                for j in range(10):
+                    with open(os.path.join(folder, 'f{}'.format(j)), 'w') as f:
+                        f.write('x' * (j + 1))
+            tree = SpillingFileSystemTree(root, max_resident_nodes=5)
+        view = TreemapView(tree)
+        view.rects(400, 300)
+        stubs = [leaf for leaf in view.large_leaves(100) if leaf.is_stub()]
+        self.assertEqual(len(stubs), 4)
+        for stub in stubs:
+            stub.expand()
+        view.invalidate()
+        view.rects(400, 300)
+        self.assertEqual(len(view.large_leaves(100)), 0)
+        self.assertEqual(len(view.large_leaves(1)), 40)
+        tree.close()
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'inotify is Linux only')
+class TreeWatcherTest(unittest.TestCase):
+    def test_batched_changes(self):
+        with tempfile.TemporaryDirectory() as root:
+            os.mkdir(os.path.join(root, 'A'))
+            with open(os.path.join(root, 'A', 'f1'), 'w') as f:
+                f.write('x' * 10)
+            tree = FileSystemTree(root)
+            watcher = TreeWatcher(tree, root)
+            try:
+                self.assertFalse(watcher.update())
+                with open(os.path.join(root, 'A', 'f1'), 'a') as f:
+                    f.write('x' * 5)
+                os.mkdir(os.path.join(root, 'B'))
+                with open(os.path.join(root, 'B', 'f2'), 'w') as f:
+                    f.write('x' * 7)
+                self.assertTrue(watcher.update())
+                self.assertEqual(tree.data_size, 22)
+
+                # A moved folder keeps its subtree objects.
+                folder_a = tree.subtrees()[0]
+                os.rename(os.path.join(root, 'A'),
+                          os.path.join(root, 'B', 'C'))
+                os.remove(os.path.join(root, 'B', 'f2'))
+                self.assertTrue(watcher.update())
+                self.assertEqual(tree.data_size, 15)
+                folder_b = tree.subtrees()[0]
+                self.assertEqual(folder_b.subtrees(), [folder_a])
+                self.assertEqual(folder_a.treename(), 'C')
+                self.assertEqual(folder_b.data_size, 15)
+            finally:
+                watcher.close()
+
+    def test_written_then_renamed(self):
+        with tempfile.TemporaryDirectory() as root:
+            os.mkdir(os.path.join(root, 'A'))
+            with open(os.path.join(root, 'A', 'f1'), 'w') as f:
+                f.write('x' * 10)
+            with open(os.path.join(root, 'A', 'f2'), 'w') as f:
+                f.write('x' * 5)
+            tree = FileSystemTree(root)
+            watcher = TreeWatcher(tree, root)
+            try:
+                # Written under one name and renamed in the same batch, as
+                # editors and downloaders do.
+                with open(os.path.join(root, 'g'), 'w') as f:
+                    f.write('x' * 7)
+                os.rename(os.path.join(root, 'g'),
+                          os.path.join(root, 'A', 'f1'))
+                self.assertTrue(watcher.update())
+                self.assertEqual(tree.data_size, 12)
+                self.assertEqual(sorted(t.treename() for t
+                                        in tree.subtrees()[0].subtrees()),
+                                 ['f1', 'f2'])
+            finally:
+                watcher.close()
+
+    def test_removed_from_tree(self):
+        with tempfile.TemporaryDirectory() as root:
+            os.mkdir(os.path.join(root, 'A'))
+            for name, size in (('f1', 10), ('f2', 5), ('f3', 3)):
+                with open(os.path.join(root, 'A', name), 'w') as f:
+                    f.write('x' * size)
+            tree = FileSystemTree(root)
+            watcher = TreeWatcher(tree, root)
+            try:
+                folder_a = tree.subtrees()[0]
+                f1, f2, f3 = sorted(folder_a.subtrees(),
+                                    key=lambda t: t.treename())
+                # Deleted in the visualiser, through the watcher or not.
+                watcher.remove(f2)
+                f1.detach()
+                self.assertEqual(tree.data_size, 3)
+                self.assertIsNone(f1.get_parent())
+                self.assertFalse(watcher.contains(f2))
+
+                # Later changes on disk must not touch the removed leaves.
+                with open(os.path.join(root, 'A', 'f1'), 'a') as f:
+                    f.write('x' * 4)
+                with open(os.path.join(root, 'A', 'f2'), 'a') as f:
+                    f.write('x' * 4)
+                os.remove(os.path.join(root, 'A', 'f1'))
+                watcher.update()
+                self.assertEqual(tree.data_size, 3)
+                self.assertEqual(folder_a.subtrees(), [f3])
+                self.assertEqual(f2.data_size, 5)
+
+                with open(os.path.join(root, 'A', 'f1'), 'w') as f:
+                    f.write('x' * 2)
+                self.assertTrue(watcher.update())
+                self.assertEqual(tree.data_size, 5)
+            finally:
+                watcher.close()
+
+    def test_pruned_tree(self):
+        with tempfile.TemporaryDirectory() as root:
+            tree = FileSystemTree(root, exclude=['.git'])
+            with self.assertRaises(ValueError):
+                TreeWatcher(tree, root, exclude=['.git'])
+
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        leaves = [SnapshotTree('f{}'.format(i), [], i + 1) for i in range(6)]
+        self.tree = SnapshotTree('R', [SnapshotTree('A', leaves[:3]),
+                                       SnapshotTree('B', leaves[3:])])
+
+    def test_matches_generate_treemap(self):
+        rects = [(rect, colour) for _, rect, _, colour
+                 in iter_treemap(self.tree, (0, 0, 300, 200))]
+        self.assertEqual(rects, self.tree.generate_treemap((0, 0, 300, 200)))
+
+    def test_formats(self):
+        expected = list(iter_treemap(self.tree, (0, 0, 300, 200), 4, 10))
+        self.assertTrue(all(rect[0] % 4 == 0 and rect[2] % 4 == 0
+                            for _, rect, _, _ in expected))
+        with tempfile.TemporaryDirectory() as folder:
+            counts = [export_treemap(self.tree, os.path.join(folder, name),
+                                     300, 200, 4, 10)
+                      for name in ('map.jsonl', 'map.svg', 'map.bin')]
+            with open(os.path.join(folder, 'map.jsonl')) as f:
+                lines = [json.loads(line) for line in f]
+            with open(os.path.join(folder, 'map.bin'), 'rb') as f:
+                width, height, records = read_binary(f)
+                records = list(records)
+        self.assertEqual(counts, [len(expected)] * 3)
+        self.assertEqual([line['path'] for line in lines],
+                         [path for path, _, _, _ in expected])
+        self.assertEqual((width, height), (300, 200))
+        self.assertEqual(records, expected)
+
+    def test_long_paths(self):
+        # Longer than 65535 bytes, and sharing more than that with the next.
+        name = 'x' * 70000
+        tree = SnapshotTree(name, [SnapshotTree(name + 'a', [], 1),
+                                   SnapshotTree(name + 'b', [], 1)])
+        expected = list(iter_treemap(tree, (0, 0, 10, 10)))
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'map.bin')
+            export_treemap(tree, path, 10, 10)
+            with open(path, 'rb') as f:
+                records = list(read_binary(f)[2])
+        self.assertEqual(records, expected)
+
+
 if __name__ == '__main__':
     unittest.main(exit=False)
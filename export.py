@@ -0,0 +1,300 @@
+"""Streaming Treemap Export
+
+=== Module Description ===
+This module writes the treemap of a tree to files that other programs (e.g.
+web dashboards) can display: JSON lines, SVG, or a compact binary format.
+
+The rectangles are produced one at a time by iter_treemap, which runs the
+same algorithm as AbstractTree.generate_treemap, and each one is written out
+as soon as it is computed. Only the subtrees on the path to the current leaf
+are remembered, so exporting uses the same small amount of memory however
+many leaves the tree has.
+
+The coordinates can be quantized to a grid of <quantum> pixels, which makes
+the files smaller and compress better, and the subtrees narrower or shorter
+than <min_pixels> can be skipped altogether.
+
+=== Binary Format ===
+All numbers are little-endian. The file starts with the header
+
+    magic (4 bytes, b'TMAP'), version (uint16), width, height (uint32)
+
+followed by one record per rectangle:
+
+    x, y, width, height (uint32), size (uint64), red, green, blue (uint8),
+    shared (uint16), length (uint32), suffix (<length> bytes)
+
+The path of the rectangle is the first <shared> bytes of the previous path,
+followed by <suffix>, encoded in UTF-8. At most 65535 bytes are shared, so
+that <shared> fits in 16 bits; the rest of a longer path is in <suffix>.
+"""
+import json
+import struct
+from html import escape
+
+import instrumentation
+
+
+# The version written in the header of binary exports.
+BINARY_VERSION = 2
+
+_BINARY_HEADER = struct.Struct('<4sHII')
+_BINARY_RECORD = struct.Struct('<IIIIQBBBHI')
+_BINARY_MAGIC = b'TMAP'
+
+
+def iter_treemap(tree, rect, quantum=1, min_pixels=0):
+    """Yield the treemap of <tree> in <rect> one leaf at a time, as
+    (path, rectangle, size, colour) tuples.
+
+    The path is the names of the subtrees from the root of <tree> to the
+    leaf, joined by their separators, as in the visualiser. The rectangles
+    are those of generate_treemap, with their edges rounded to the nearest
+    multiple of <quantum>; rectangles that become empty are left out.
+    Subtrees whose rectangle is narrower or shorter than <min_pixels> are
+    skipped with all their leaves.
+
+    @type tree: AbstractTree
+    @type rect: (int, int, int, int)
+    @type quantum: int
+    @type min_pixels: int
+    @rtype: generator
+
+    >>> from snapshot import SnapshotTree
+    >>> a1 = SnapshotTree('f1', [], 10)
+    >>> a2 = SnapshotTree('f2', [], 30)
+    >>> a3 = SnapshotTree('F1', [a1, a2])
+    >>> [(p, r, s) for p, r, s, _ in iter_treemap(a3, (0, 0, 100, 50))]
+    [('F1/f1', (0, 0, 25, 50), 10), ('F1/f2', (25, 0, 75, 50), 30)]
+    >>> [r for _, r, _, _ in iter_treemap(a3, (0, 0, 100, 50), quantum=10)]
+    [(0, 0, 30, 50), (30, 0, 70, 50)]
+    >>> [p for p, _, _, _ in iter_treemap(a3, (0, 0, 100, 50), min_pixels=30)]
+    ['F1/f2']
+    """
+    # As in generate_treemap, an explicit stack of iterators over
+    # (subtree, rectangle) pairs; <paths> holds the path of the subtree each
+    # iterator belongs to.
+    stack = [iter([(tree, rect)])]
+    paths = ['']
+    while len(stack) != 0:
+        for subtree, subtree_rect in stack[-1]:
+            _, _, width, height = subtree_rect
+            if subtree.data_size == 0 or width < min_pixels or \
+                    height < min_pixels:
+                continue
+            if len(stack) == 1:
+                path = str(subtree.treename())
+            else:
+                path = paths[-1] + subtree.get_separator() + \
+                    str(subtree.treename())
+            if len(subtree.subtrees()) != 0:
+                stack.append(subtree.iter_subtree_rects(subtree_rect))
+                paths.append(path)
+                break
+            subtree_rect = _leaf_rect(subtree_rect, quantum)
+            if subtree_rect is not None:
+                yield path, subtree_rect, subtree.data_size, subtree.color
+        else:  # every subtree at this level is done
+            stack.pop()
+            paths.pop()
+
+
+def export_treemap(tree, path, width, height, quantum=1, min_pixels=0):
+    """Write the <width> x <height> treemap of <tree> to the file at <path>,
+    in the format given by its extension: .jsonl, .svg, or anything else for
+    the binary format. Return the number of rectangles written.
+
+    See iter_treemap for <quantum> and <min_pixels>.
+
+    @type tree: AbstractTree
+    @type path: str
+    @type width: int
+    @type height: int
+    @type quantum: int
+    @type min_pixels: int
+    @rtype: int
+    """
+    rects = iter_treemap(tree, (0, 0, width, height), quantum, min_pixels)
+    with instrumentation.phase('export'):
+        if path.endswith('.jsonl') or path.endswith('.svg'):
+            with open(path, 'w', encoding='utf-8', errors='surrogateescape',
+                      newline='\n') as f:
+                if path.endswith('.svg'):
+                    count = write_svg(rects, f, width, height)
+                else:
+                    count = write_jsonl(rects, f)
+        else:
+            with open(path, 'wb') as f:
+                count = write_binary(rects, f, width, height)
+    instrumentation.count('rects_exported', count)
+    return count
+
+
+def write_jsonl(rects, f):
+    """Write the (path, rectangle, size, colour) tuples <rects> to the open
+    text file <f>, one JSON object per line. Return the number written.
+
+    @type rects: iterable[(str, (int, int, int, int), int, (int, int, int))]
+    @type f: file
+    @rtype: int
+    """
+    count = 0
+    for path, (x, y, width, height), size, colour in rects:
+        f.write('{{"path": {}, "x": {}, "y": {}, "w": {}, "h": {}, '
+                '"size": {}, "color": "#{:02x}{:02x}{:02x}"}}\n'.format(
+                    json.dumps(path), x, y, width, height, size, *colour))
+        count += 1
+    return count
+
+
+def write_svg(rects, f, width, height):
+    """Write the (path, rectangle, size, colour) tuples <rects> to the open
+    text file <f> as a <width> x <height> SVG image, with the path and size
+    of each rectangle as its tooltip. Return the number written.
+
+    @type rects: iterable[(str, (int, int, int, int), int, (int, int, int))]
+    @type f: file
+    @type width: int
+    @type height: int
+    @rtype: int
+    """
+    f.write('<svg xmlns="http://www.w3.org/2000/svg" width="{0}" '
+            'height="{1}" viewBox="0 0 {0} {1}">\n'.format(width, height))
+    count = 0
+    for path, (x, y, rect_width, rect_height), size, colour in rects:
+        f.write('<rect x="{}" y="{}" width="{}" height="{}" '
+                'fill="#{:02x}{:02x}{:02x}"><title>{} ({})</title></rect>\n'
+                .format(x, y, rect_width, rect_height, *colour,
+                        escape(path), size))
+        count += 1
+    f.write('</svg>\n')
+    return count
+
+
+def write_binary(rects, f, width, height):
+    """Write the (path, rectangle, size, colour) tuples <rects> of a
+    <width> x <height> treemap to the open binary file <f>, in the binary
+    format described above. Return the number written.
+
+    @type rects: iterable[(str, (int, int, int, int), int, (int, int, int))]
+    @type f: file
+    @type width: int
+    @type height: int
+    @rtype: int
+    """
+    f.write(_BINARY_HEADER.pack(_BINARY_MAGIC, BINARY_VERSION, width, height))
+    pack = _BINARY_RECORD.pack
+    previous = b''
+    count = 0
+    for path, (x, y, rect_width, rect_height), size, colour in rects:
+        encoded = path.encode('utf-8', 'surrogateescape')
+        shared = _shared_prefix(previous, encoded)
+        f.write(pack(x, y, rect_width, rect_height, size, colour[0],
+                     colour[1], colour[2], shared, len(encoded) - shared))
+        f.write(encoded[shared:])
+        previous = encoded
+        count += 1
+    return count
+
+
+def read_binary(f):
+    """Read a treemap written by write_binary from the open binary file <f>.
+
+    Return its width and height, and a generator of its (path, rectangle,
+    size, colour) tuples.
+
+    @type f: file
+    @rtype: (int, int, generator)
+    """
+    magic, version, width, height = _BINARY_HEADER.unpack(
+        f.read(_BINARY_HEADER.size))
+    if magic != _BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError('not a version {} binary treemap'.format(
+            BINARY_VERSION))
+    return width, height, _read_binary_records(f)
+
+
+def _read_binary_records(f):
+    """Yield the (path, rectangle, size, colour) tuples of the records of the
+    binary treemap <f>.
+
+    @type f: file
+    @rtype: generator
+    """
+    previous = b''
+    while True:
+        data = f.read(_BINARY_RECORD.size)
+        if len(data) < _BINARY_RECORD.size:
+            return
+        x, y, width, height, size, red, green, blue, shared, length = \
+            _BINARY_RECORD.unpack(data)
+        previous = previous[:shared] + f.read(length)
+        yield (previous.decode('utf-8', 'surrogateescape'),
+               (x, y, width, height), size, (red, green, blue))
+
+
+def _leaf_rect(rect, quantum):
+    """Return the rectangle to export for a leaf in <rect>: <rect> quantized
+    to <quantum> pixels, or None if that leaves it empty.
+
+    @type rect: (int, int, int, int)
+    @type quantum: int
+    @rtype: (int, int, int, int) | None
+
+    >>> _leaf_rect((3, 14, 20, 4), 8) is None
+    True
+    """
+    if quantum == 1:
+        return rect
+    rect = _quantize(rect, quantum)
+    if rect[2] == 0 or rect[3] == 0:
+        return None
+    return rect
+
+
+def _quantize(rect, quantum):
+    """Return <rect> with its edges rounded to the nearest multiple of
+    <quantum>, so that neighbouring rectangles still share their edges.
+
+    @type rect: (int, int, int, int)
+    @type quantum: int
+    @rtype: (int, int, int, int)
+
+    >>> _quantize((3, 14, 20, 4), 8)
+    (0, 16, 24, 0)
+    """
+    x, y, width, height = rect
+    left = (x + quantum // 2) // quantum * quantum
+    top = (y + quantum // 2) // quantum * quantum
+    right = (x + width + quantum // 2) // quantum * quantum
+    bottom = (y + height + quantum // 2) // quantum * quantum
+    return left, top, right - left, bottom - top
+
+
+def _shared_prefix(first, second):
+    """Return the length of the longest common prefix of <first> and
+    <second>, at most 65535.
+
+    @type first: bytes
+    @type second: bytes
+    @rtype: int
+
+    >>> _shared_prefix(b'B/A/f1', b'B/A/f2')
+    5
+    """
+    # A binary search comparing whole slices at a time.
+    low = 0
+    high = min(len(first), len(second), 65535)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[:middle] == second[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+if __name__ == '__main__':
+    import python_ta
+    # Remember to change this to check_all when cleaning up your code.
+    python_ta.check_errors(config='pylintrc.txt')
@@ -0,0 +1,246 @@
+"""Treemap Instrumentation
+
+=== Module Description ===
+This module keeps per-phase timers and counters for the hot paths of the
+treemap program: scanning the file system, generating the treemap, finding
+the leaf under the mouse cursor, drawing the rectangles and flipping the
+display.
+
+Instrumentation is disabled by default. While it is disabled, phase() returns
+a shared object that does nothing and count() returns right away, so the
+instrumented code pays almost nothing for it.
+
+Typical use:
+
+    instrumentation.enable()
+    instrumentation.add_listener(print_metrics)  # called once per frame
+    ...
+    metrics = instrumentation.get_metrics()
+    metrics.last['layout'], metrics.counters['rects_drawn']
+"""
+import time
+
+
+# Whether instrumentation is enabled. Use enable() and disable() to set it.
+ENABLED = False
+
+
+class Metrics:
+    """The timers and counters collected so far.
+
+    === Public Attributes ===
+    @type timers: dict[str, float]
+        The total time spent in each phase, in seconds.
+    @type calls: dict[str, int]
+        The number of times each phase has run.
+    @type counters: dict[str, int]
+        The total of each counter.
+    @type last: dict[str, float | int]
+        The duration of the latest run of each phase, and the latest amount
+        added to each counter.
+    @type frames: int
+        The number of frames rendered.
+    @type frame_time: float
+        The time taken by the latest frame, in seconds.
+    """
+    def __init__(self):
+        """Initialize a new set of metrics, with nothing recorded.
+
+        @type self: Metrics
+        @rtype: None
+        """
+        self.timers = {}
+        self.calls = {}
+        self.counters = {}
+        self.last = {}
+        self.frames = 0
+        self.frame_time = 0.0
+
+
+class _Phase:
+    """A timer for one run of a phase, used as a context manager.
+
+    === Private Attributes ===
+    @type _name: str
+        The name of the phase.
+    @type _start: float
+        The time the phase started at.
+    """
+    def __init__(self, name):
+        """Initialize a new timer for the phase <name>.
+
+        @type self: _Phase
+        @type name: str
+        @rtype: None
+        """
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self):
+        """Start timing the phase.
+
+        @type self: _Phase
+        @rtype: _Phase
+        """
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Stop timing the phase and record its duration.
+
+        @type self: _Phase
+        @rtype: bool
+        """
+        elapsed = time.perf_counter() - self._start
+        _metrics.timers[self._name] = \
+            _metrics.timers.get(self._name, 0.0) + elapsed
+        _metrics.calls[self._name] = _metrics.calls.get(self._name, 0) + 1
+        _metrics.last[self._name] = elapsed
+        return False
+
+
+class _NullPhase:
+    """A context manager that does nothing, used while disabled."""
+    def __enter__(self):
+        """Do nothing.
+
+        @type self: _NullPhase
+        @rtype: _NullPhase
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Do nothing.
+
+        @type self: _NullPhase
+        @rtype: bool
+        """
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+_metrics = Metrics()
+_listeners = []
+
+
+def enable():
+    """Start collecting metrics.
+
+    @rtype: None
+    """
+    global ENABLED
+    ENABLED = True
+
+
+def disable():
+    """Stop collecting metrics. The metrics collected so far are kept.
+
+    @rtype: None
+    """
+    global ENABLED
+    ENABLED = False
+
+
+def reset():
+    """Forget all the metrics collected so far.
+
+    @rtype: None
+    """
+    global _metrics
+    _metrics = Metrics()
+
+
+def get_metrics():
+    """Return the metrics collected so far.
+
+    @rtype: Metrics
+    """
+    return _metrics
+
+
+def add_listener(listener):
+    """Call <listener> with the Metrics at the end of every frame.
+
+    @type listener: callable
+    @rtype: None
+    """
+    _listeners.append(listener)
+
+
+def remove_listener(listener):
+    """Stop calling <listener> at the end of every frame.
+
+    @type listener: callable
+    @rtype: None
+    """
+    _listeners.remove(listener)
+
+
+def phase(name):
+    """Return a context manager that times a run of the phase <name>.
+
+    @type name: str
+    @rtype: _Phase | _NullPhase
+
+    >>> enable()
+    >>> with phase('layout'):
+    ...     pass
+    >>> get_metrics().calls['layout']
+    1
+    >>> disable()
+    >>> reset()
+    """
+    if not ENABLED:
+        return _NULL_PHASE
+    return _Phase(name)
+
+
+def count(name, amount=1):
+    """Add <amount> to the counter <name>.
+
+    @type name: str
+    @type amount: int
+    @rtype: None
+    """
+    if not ENABLED:
+        return
+    _metrics.counters[name] = _metrics.counters.get(name, 0) + amount
+    _metrics.last[name] = amount
+
+
+def end_frame(frame_time):
+    """Record that a frame taking <frame_time> seconds was rendered, and call
+    the listeners.
+
+    @type frame_time: float
+    @rtype: None
+    """
+    if not ENABLED:
+        return
+    _metrics.frames += 1
+    _metrics.frame_time = frame_time
+    for listener in _listeners:
+        listener(_metrics)
+
+
+def summary_lines():
+    """Return a short human-readable summary of the latest metrics, one
+    string per line.
+
+    @rtype: list[str]
+    """
+    lines = ['frame {:.1f} ms ({} frames)'.format(
+        _metrics.frame_time * 1000, _metrics.frames)]
+    for name in sorted(_metrics.timers):
+        lines.append('{} {:.1f} ms (total {:.1f} ms)'.format(
+            name, _metrics.last[name] * 1000, _metrics.timers[name] * 1000))
+    for name in sorted(_metrics.counters):
+        lines.append('{} {} (total {})'.format(
+            name, _metrics.last[name], _metrics.counters[name]))
+    return lines
+
+
+if __name__ == '__main__':
+    import python_ta
+    # Remember to change this to check_all when cleaning up your code.
+    python_ta.check_errors(config='pylintrc.txt')
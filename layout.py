@@ -0,0 +1,465 @@
+"""Normalized Treemap Layouts
+
+=== Module Description ===
+This module computes the treemap layout of a tree once, independently of the
+size it will be displayed at, so that it can be drawn at any resolution (or
+only in part, a tile at a time) without running the treemap algorithm again.
+
+The layout uses the same algorithm as AbstractTree.generate_treemap, but
+without rounding: every rectangle is stored with floating point coordinates
+normalized to the unit square, where (0, 0) is the top left corner and
+(1, 1) the bottom right corner of the treemap. Only the aspect ratio of the
+display (width / height) is needed to decide which way each rectangle is
+split.
+
+Rectangles are stored by their edges rather than their sizes, and each
+edge shared by neighbouring rectangles, or by a rectangle and its parent, is
+computed once; so when the layout is scaled and rounded to pixels, the
+leaves exactly tile their parents.
+
+All non-empty subtrees are stored, not only the leaves, in preorder. Each
+one also stores the index just past its last descendant, so that a subtree
+that falls outside the area being drawn can be skipped as a whole.
+
+A TreemapView keeps the layout of a tree and scales it to the size of the
+window it is displayed in. The scaling is a single vectorized pass over all
+the leaves when numpy is installed, and otherwise a loop that skips the
+subtrees smaller than a pixel as a whole. Either way, the scaled rectangles
+are kept as arrays (see ScaledRects), and the (rectangle, colour) tuple of
+a leaf is only made when it is drawn.
+"""
+from array import array
+
+try:
+    import numpy
+except ImportError:  # numpy is optional; see TreemapView.rects
+    numpy = None
+
+import instrumentation
+
+
+class NormalizedLayout:
+    """The treemap layout of a tree, in normalized coordinates.
+
+    === Public Attributes ===
+    @type aspect: float
+        The width / height ratio the layout was computed for.
+    @type trees: list[AbstractTree]
+        The non-empty subtrees of the tree, in preorder.
+    @type xs: array[float]
+    @type ys: array[float]
+    @type rights: array[float]
+    @type bottoms: array[float]
+        The normalized left, top, right and bottom edges of the rectangle of
+        each tree in <trees>.
+    @type ends: array[int]
+        For each tree in <trees>, the index just past its last descendant.
+
+    === Representation Invariants ===
+    - All the attributes except aspect have the same length.
+    - For every index i, i < ends[i], and the trees at indexes i + 1 to
+      ends[i] - 1 are exactly the non-empty descendants of trees[i].
+    """
+    def __init__(self, tree, aspect):
+        """Compute the layout of <tree> for a display whose width divided by
+        its height is <aspect>.
+
+        @type self: NormalizedLayout
+        @type tree: AbstractTree
+        @type aspect: float
+        @rtype: None
+
+        >>> from tree_data import AbstractTree
+        >>> a1 = AbstractTree('f1', [], 10)
+        >>> a2 = AbstractTree('f2', [], 30)
+        >>> layout = NormalizedLayout(AbstractTree('F1', [a1, a2], 0), 2.0)
+        >>> list(layout.xs), list(layout.rights), list(layout.ends)
+        ([0.0, 0.0, 0.25], [1.0, 0.25, 1.0], [3, 2, 3])
+        """
+        self.aspect = aspect
+        self.trees = []
+        self.xs = array('d')
+        self.ys = array('d')
+        self.rights = array('d')
+        self.bottoms = array('d')
+        self.ends = array('l')
+        # The layout is computed in units where the display is <aspect> wide
+        # and 1 high, so that the split directions match the display; the x
+        # coordinates are divided by <aspect> when they are stored. Rectangles
+        # are (left, top, right, bottom).
+        # Each stack entry is (tree, rect), or (None, index) to mark the end
+        # of the subtree at index.
+        stack = [(tree, (0.0, 0.0, aspect, 1.0))]
+        while len(stack) != 0:
+            subtree, rect = stack.pop()
+            if subtree is None:
+                self.ends[rect] = len(self.trees)
+            elif subtree.data_size != 0:
+                index = len(self.trees)
+                self._append(subtree, rect)
+                stack.append((None, index))
+                children = subtree.subtrees()
+                if len(children) != 0:
+                    stack.extend(reversed(_split(subtree, children, rect)))
+
+    def __len__(self):
+        """Return the number of non-empty trees in this layout.
+
+        @type self: NormalizedLayout
+        @rtype: int
+        """
+        return len(self.trees)
+
+    def is_leaf(self, index):
+        """Return whether the tree at <index> is a leaf.
+
+        A non-empty tree always has a non-empty subtree, if it has any, so
+        the leaves are the trees without descendants in the layout.
+
+        @type self: NormalizedLayout
+        @type index: int
+        @rtype: bool
+        """
+        return self.ends[index] == index + 1
+
+    def visible_leaves(self, left, top, right, bottom, width, height):
+        """Yield the pixel rectangle and colour of every leaf that overlaps
+        the area from (<left>, <top>) to (<right>, <bottom>) when the layout
+        is drawn at <width> x <height> pixels.
+
+        Rectangles are in pixels of the whole drawing, not of the area.
+        Subtrees outside the area, or too thin to cover a single pixel, are
+        skipped without looking at their leaves.
+
+        @type self: NormalizedLayout
+        @type left: int
+        @type top: int
+        @type right: int
+        @type bottom: int
+        @type width: int
+        @type height: int
+        @rtype: generator
+        """
+        xs, ys, rights, bottoms = self.xs, self.ys, self.rights, self.bottoms
+        ends, trees = self.ends, self.trees
+        i = 0
+        while i < len(trees):
+            x0 = int(xs[i] * width)
+            x1 = int(rights[i] * width)
+            y0 = int(ys[i] * height)
+            y1 = int(bottoms[i] * height)
+            if x1 <= left or x0 >= right or y1 <= top or y0 >= bottom or \
+                    x0 == x1 or y0 == y1:
+                i = ends[i]  # skip the whole subtree
+            elif ends[i] == i + 1:  # a leaf
+                yield (x0, y0, x1 - x0, y1 - y0), trees[i].color
+                i += 1
+            else:
+                i += 1
+
+    def _append(self, tree, rect):
+        """Store <tree> with its rectangle <rect>, by its edges in layout
+        units.
+
+        @type self: NormalizedLayout
+        @type tree: AbstractTree
+        @type rect: (float, float, float, float)
+        @rtype: None
+        """
+        left, top, right, bottom = rect
+        self.trees.append(tree)
+        self.xs.append(left / self.aspect)
+        self.ys.append(top)
+        self.rights.append(right / self.aspect)
+        self.bottoms.append(bottom)
+        self.ends.append(0)  # set once the subtree is done
+
+
+class ScaledRects:
+    """The rectangles and colours of the leaves of a layout drawn at some
+    size, leaving out the leaves too small to cover a pixel.
+
+    The rectangles are kept as arrays with one element per leaf, rather than
+    as one tuple per leaf. Iterating yields the ((x, y, width, height),
+    colour) of each leaf in turn, like the lists of generate_treemap.
+
+    === Public Attributes ===
+    @type xs: array[int] | numpy.ndarray
+    @type ys: array[int] | numpy.ndarray
+    @type widths: array[int] | numpy.ndarray
+    @type heights: array[int] | numpy.ndarray
+        The pixel rectangle of each leaf.
+
+    === Private Attributes ===
+    @type _indexes: array[int] | numpy.ndarray
+        The index of the colour of each leaf in <_colours>.
+    @type _colours: list[(int, int, int)]
+        The colours the leaves are drawn with.
+    """
+    def __init__(self, rects, indexes, colours):
+        """Initialize new rectangles from the (xs, ys, widths, heights)
+        arrays <rects>, and the index in <colours> of the colour of each
+        leaf.
+
+        @type self: ScaledRects
+        @type rects: tuple
+        @type indexes: array[int] | numpy.ndarray
+        @type colours: list[(int, int, int)]
+        @rtype: None
+        """
+        self.xs, self.ys, self.widths, self.heights = rects
+        self._indexes = indexes
+        self._colours = colours
+
+    def __len__(self):
+        """Return the number of leaves drawn.
+
+        @type self: ScaledRects
+        @rtype: int
+        """
+        return len(self.xs)
+
+    def __iter__(self):
+        """Yield the ((x, y, width, height), colour) of every leaf drawn.
+
+        @type self: ScaledRects
+        @rtype: generator
+        """
+        colours = self._colours
+        for x, y, width, height, index in zip(
+                self.xs.tolist(), self.ys.tolist(), self.widths.tolist(),
+                self.heights.tolist(), self._indexes.tolist()):
+            yield (x, y, width, height), colours[index]
+
+
+class TreemapView:
+    """The layout of a tree, scaled to the size of the window it is shown in.
+
+    The normalized layout is computed the first time the tree is shown, for
+    the aspect ratio of the window at that time, and is kept until the tree
+    changes. Resizing the window only scales it again.
+
+    === Public Attributes ===
+    @type tree: AbstractTree
+        The tree shown.
+    @type size: (int, int)
+        The width and height of the treemap last drawn, in pixels.
+
+    === Private Attributes ===
+    @type _layout: NormalizedLayout | None
+        The layout of the tree, or None if it has to be computed again.
+    @type _leaves: list[int]
+        The indexes of the leaves in the layout.
+    @type _colours: list[(int, int, int)]
+        The colours of the leaves in the layout.
+    @type _arrays: tuple | None
+        The numpy arrays of the leaf rectangles, if numpy is installed.
+    @type _rects: ScaledRects
+        The rectangles of the treemap last drawn.
+    """
+    def __init__(self, tree):
+        """Initialize a new view of <tree>.
+
+        @type self: TreemapView
+        @type tree: AbstractTree
+        @rtype: None
+        """
+        self.tree = tree
+        self.size = (0, 0)
+        self._layout = None
+        self._leaves = []
+        self._colours = []
+        self._arrays = None
+        self._rects = ScaledRects(tuple(array('l') for _ in range(4)),
+                                  array('l'), [])
+
+    def invalidate(self):
+        """Forget the layout, after the tree has changed.
+
+        @type self: TreemapView
+        @rtype: None
+        """
+        self._layout = None
+        self.size = (0, 0)
+
+    def rects(self, width, height):
+        """Return the rectangle and colour of every leaf of the treemap drawn
+        at <width> x <height> pixels, leaving out the leaves too small to
+        cover a pixel.
+
+        @type self: TreemapView
+        @type width: int
+        @type height: int
+        @rtype: ScaledRects
+        """
+        if self._layout is None:
+            with instrumentation.phase('layout'):
+                self._compute_layout(width / max(height, 1))
+        if (width, height) != self.size:
+            with instrumentation.phase('scale'):
+                if numpy is None:
+                    self._rects = self._scale(width, height)
+                else:
+                    self._rects = self._scale_vectorized(width, height)
+            self.size = (width, height)
+        return self._rects
+
+    def leaf_at(self, x, y):
+        """Return the trees from the root to the leaf at the pixel (<x>, <y>)
+        of the treemap last drawn, or None if there is no leaf there.
+
+        @type self: TreemapView
+        @type x: int
+        @type y: int
+        @rtype: list[AbstractTree] | None
+        """
+        layout = self._layout
+        if layout is None or len(layout) == 0:
+            return None
+        with instrumentation.phase('leaf_at'):
+            if not self._contains(0, x, y):
+                return None
+            path = [layout.trees[0]]
+            i = 0
+            while not layout.is_leaf(i):
+                j = i + 1
+                while j < layout.ends[i] and not self._contains(j, x, y):
+                    j = layout.ends[j]
+                if j == layout.ends[i]:  # in none of the subtrees
+                    return None
+                path.append(layout.trees[j])
+                i = j
+        instrumentation.count('hit_test_levels', len(path))
+        return path
+
+    def large_leaves(self, min_pixels):
+        """Return the leaves whose rectangle, as last drawn, is at least
+        <min_pixels> wide and high.
+
+        @type self: TreemapView
+        @type min_pixels: int
+        @rtype: list[AbstractTree]
+        """
+        layout = self._layout
+        if layout is None:
+            return []
+        width, height = self.size
+        return [layout.trees[i] for i in self._leaves
+                if int(layout.rights[i] * width) -
+                int(layout.xs[i] * width) >= min_pixels and
+                int(layout.bottoms[i] * height) -
+                int(layout.ys[i] * height) >= min_pixels]
+
+    def _compute_layout(self, aspect):
+        """Compute the normalized layout of the tree for <aspect>.
+
+        @type self: TreemapView
+        @type aspect: float
+        @rtype: None
+        """
+        layout = NormalizedLayout(self.tree, aspect)
+        self._layout = layout
+        self._leaves = [i for i in range(len(layout)) if layout.is_leaf(i)]
+        self._colours = [layout.trees[i].color for i in self._leaves]
+        if numpy is not None:
+            leaves = numpy.array(self._leaves, dtype=numpy.int64)
+            self._arrays = tuple(numpy.frombuffer(values, dtype=numpy.float64)
+                                 [leaves] for values in
+                                 (layout.xs, layout.ys, layout.rights,
+                                  layout.bottoms))
+
+    def _scale(self, width, height):
+        """Return the leaf rectangles at <width> x <height> pixels, one leaf
+        at a time, skipping the subtrees smaller than a pixel.
+
+        @type self: TreemapView
+        @type width: int
+        @type height: int
+        @rtype: ScaledRects
+        """
+        rects = tuple(array('l') for _ in range(4))
+        xs, ys, widths, heights = rects
+        colours = []
+        for (x, y, rect_width, rect_height), colour in \
+                self._layout.visible_leaves(0, 0, width, height, width,
+                                            height):
+            xs.append(x)
+            ys.append(y)
+            widths.append(rect_width)
+            heights.append(rect_height)
+            colours.append(colour)
+        return ScaledRects(rects, array('l', range(len(colours))), colours)
+
+    def _scale_vectorized(self, width, height):
+        """Return the leaf rectangles at <width> x <height> pixels, scaling
+        all the leaves at once with numpy.
+
+        @type self: TreemapView
+        @type width: int
+        @type height: int
+        @rtype: ScaledRects
+        """
+        xs, ys, rights, bottoms = self._arrays
+        x0 = (xs * width).astype(numpy.int64)
+        y0 = (ys * height).astype(numpy.int64)
+        rect_widths = (rights * width).astype(numpy.int64) - x0
+        rect_heights = (bottoms * height).astype(numpy.int64) - y0
+        kept = numpy.nonzero((rect_widths > 0) & (rect_heights > 0))[0]
+        return ScaledRects((x0[kept], y0[kept], rect_widths[kept],
+                            rect_heights[kept]), kept, self._colours)
+
+    def _contains(self, index, x, y):
+        """Return whether the rectangle of the tree at <index>, as last drawn,
+        contains the pixel (<x>, <y>).
+
+        @type self: TreemapView
+        @type index: int
+        @type x: int
+        @type y: int
+        @rtype: bool
+        """
+        layout = self._layout
+        width, height = self.size
+        return int(layout.xs[index] * width) <= x < \
+            int(layout.rights[index] * width) and \
+            int(layout.ys[index] * height) <= y < \
+            int(layout.bottoms[index] * height)
+
+
+def _split(tree, subtrees, rect):
+    """Split <rect> between <subtrees>, the subtrees of <tree>, like
+    AbstractTree.subtree_rects but without rounding.
+
+    Rectangles are given by their (left, top, right, bottom) edges.
+
+    @type tree: AbstractTree
+    @type subtrees: list[AbstractTree]
+    @type rect: (float, float, float, float)
+    @rtype: list[(AbstractTree, (float, float, float, float))]
+    """
+    left, top, right, bottom = rect
+    total = tree.data_size
+    pairs = []
+    # Each rectangle starts exactly where the previous one ends, and the
+    # last one ends exactly where <rect> does, so no floating point error
+    # can leave a gap or an overlap.
+    if right - left > bottom - top:
+        width = right - left
+        for i in range(0, len(subtrees) - 1):
+            edge = left + subtrees[i].data_size / total * width
+            pairs.append((subtrees[i], (left, top, edge, bottom)))
+            left = edge
+        pairs.append((subtrees[-1], (left, top, right, bottom)))
+    else:  # width <= height
+        height = bottom - top
+        for i in range(0, len(subtrees) - 1):
+            edge = top + subtrees[i].data_size / total * height
+            pairs.append((subtrees[i], (left, top, right, edge)))
+            top = edge
+        pairs.append((subtrees[-1], (left, top, right, bottom)))
+    return pairs
+
+if __name__ == '__main__':
+    import python_ta
+    # Remember to change this to check_all when cleaning up your code.
+    python_ta.check_errors(config='pylintrc.txt')
@@ -0,0 +1,250 @@
+"""Sharded File System Scans
+
+=== Module Description ===
+This module splits the scan of a large folder into shards, so that the
+subfolders can be scanned in parallel, on one machine or on several.
+
+Each shard is the scan of one path below a common root, saved as a snapshot
+file (see snapshot.py) whose header records the scanned path. The shards are
+then merged into a single tree under the common root, without rescanning:
+the trees loaded from the shards are attached under the root (and under any
+folders between the root and the shards), and the data_size and _parent_tree
+attributes of those folders are set in one pass.
+
+From the command line, a shard is scanned with
+
+    python shard.py scan <path> <shard file> [<options>]
+
+where <options> are FileSystemTree options as a JSON object, e.g.
+'{"exclude": [".git"]}'. scan_shards_locally runs one such process per
+subfolder of a folder, and scans the files directly in the folder itself.
+"""
+import json
+import os
+import subprocess
+import sys
+from fnmatch import fnmatch
+
+from snapshot import SnapshotTree, build_tree, read_snapshot, save_snapshot
+from tree_data import FileSystemTree
+
+
+# The number of shard processes scan_shards_locally runs at the same time.
+DEFAULT_PROCESSES = 4
+
+
+def scan_shard(path, shard_path, **options):
+    """Scan <path> and save it to the shard file <shard_path>.
+
+    <options> are passed on to the FileSystemTree constructor.
+
+    @type path: str
+    @type shard_path: str
+    @rtype: None
+    """
+    tree = FileSystemTree(path, **options)
+    save_snapshot(tree, shard_path, source=os.path.abspath(path))
+
+
+def merge_shards(root, shard_paths):
+    """Return the tree of the folder <root>, made of the given shards.
+
+    Every shard must be the scan of a path inside <root>, and no shard may
+    be the scan of a path inside (or equal to) that of another shard; a
+    ValueError naming the shard files is raised otherwise. The subtrees of
+    each folder are in the order of <shard_paths>.
+
+    @type root: str
+    @type shard_paths: list[str]
+    @rtype: SnapshotTree
+    """
+    root = os.path.abspath(root)
+    # Check where every shard goes from its header before building any.
+    shard_names = []
+    for shard_path in shard_paths:
+        header, records = read_snapshot(shard_path)
+        records.close()
+        relative = os.path.relpath(header['source'], root)
+        if relative == os.curdir or relative.split(os.sep)[0] == os.pardir:
+            raise ValueError('shard {} of {} is not inside {}'.format(
+                shard_path, header['source'], root))
+        shard_names.append((relative.split(os.sep), shard_path))
+    _check_overlaps(shard_names)
+
+    separator = '/'
+    # The folders between the root and the shards, as nested dicts from
+    # names to subfolders; the shard trees themselves are the leaves.
+    folders = {}
+    for names, shard_path in shard_names:
+        header, records = read_snapshot(shard_path)
+        separator = header['separator']
+        folder = folders
+        for name in names[:-1]:
+            folder = folder.setdefault(name, {})
+        folder[names[-1]] = build_tree(records, separator)
+    return _build_folders(os.path.basename(root), folders, separator)
+
+
+def scan_shards_locally(root, shard_folder, processes=DEFAULT_PROCESSES,
+                        **options):
+    """Scan every subfolder of the folder <root> in a separate process, and
+    the files directly in <root> in this one, and save one shard file per
+    entry in <shard_folder>.
+
+    <options> are passed on to the FileSystemTree constructor of every scan,
+    as if <root> was scanned at once: max_depth counts from <root>, and the
+    entries of <root> matching <exclude> are skipped.
+
+    At most <processes> scans run at the same time. Return the paths of the
+    shard files, in os.listdir order.
+
+    If a scan fails, the scans still running are stopped and RuntimeError
+    is raised.
+
+    @type root: str
+    @type shard_folder: str
+    @type processes: int
+    @rtype: list[str]
+    """
+    # The files of <root>, scanned with the same options as its subfolders.
+    files_options = dict(options, max_depth=1, collapse_pruned=False)
+    files_tree = FileSystemTree(root, **files_options)
+    files = {leaf.treename(): leaf for leaf in files_tree.subtrees()}
+    folders_options = dict(options)
+    if options.get('max_depth') is not None:
+        folders_options['max_depth'] = options['max_depth'] - 1
+    shard_paths = []
+    running = []
+    try:
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            shard_path = os.path.join(shard_folder,
+                                      '{}.shard'.format(len(shard_paths)))
+            if name in files:
+                save_snapshot(files[name], shard_path,
+                              source=os.path.abspath(path))
+            elif _is_shard_folder(path, options):
+                _start_scan(running, processes, path, shard_path,
+                            folders_options)
+            else:
+                continue
+            shard_paths.append(shard_path)
+        while len(running) != 0:
+            _wait(running.pop(0))
+    except BaseException:
+        for process in running:
+            process.terminate()
+            process.wait()
+        raise
+    return shard_paths
+
+
+def _is_shard_folder(path, options):
+    """Return whether the entry <path> of the root is a folder that is
+    scanned with the given FileSystemTree <options>.
+
+    @type path: str
+    @type options: dict[str, object]
+    @rtype: bool
+    """
+    if options.get('max_depth') == 1:  # the subfolders are not opened
+        return False
+    if not os.path.isdir(path):
+        return False
+    if not options.get('follow_symlinks', True) and os.path.islink(path):
+        return False
+    # At the top level, the name of an entry is also its relative path.
+    return not any(fnmatch(os.path.basename(path), pattern)
+                   for pattern in options.get('exclude') or [])
+
+
+def _start_scan(running, processes, path, shard_path, options):
+    """Start a process scanning <path> with the FileSystemTree <options>
+    into the shard file <shard_path>, and add it to <running>. If <running>
+    already has <processes> processes, wait for the oldest one first.
+
+    @type running: list[subprocess.Popen]
+    @type processes: int
+    @type path: str
+    @type shard_path: str
+    @type options: dict[str, object]
+    @rtype: None
+    """
+    if len(running) == processes:
+        _wait(running.pop(0))
+    running.append(subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), 'scan', path, shard_path,
+         json.dumps(options)]))
+
+
+def _build_folders(name, folders, separator):
+    """Return the tree named <name> whose subtrees are described by
+    <folders>, a nested dict of folders whose values are either dicts (for
+    folders) or shard trees.
+
+    @type name: str
+    @type folders: dict
+    @type separator: str
+    @rtype: SnapshotTree
+    """
+    # Each stack entry is (name, folder, ready): ready is True once the
+    # subfolders of the folder have been built.
+    stack = [(name, folders, False)]
+    built = {}  # the id of each folder dict built so far, to its tree
+    while len(stack) != 0:
+        folder_name, folder, ready = stack.pop()
+        if ready:
+            subtrees = [built.pop(id(child)) if isinstance(child, dict)
+                        else child for child in folder.values()]
+            built[id(folder)] = SnapshotTree(folder_name, subtrees, 0,
+                                             separator)
+        else:
+            stack.append((folder_name, folder, True))
+            stack.extend((child_name, child, False)
+                         for child_name, child in folder.items()
+                         if isinstance(child, dict))
+    return built[id(folders)]
+
+
+def _check_overlaps(shard_names):
+    """Raise ValueError if the path of one shard is inside, or the same as,
+    the path of another.
+
+    @type shard_names: list[(list[str], str)]
+        The names of the path of each shard relative to the root, and the
+        shard file.
+    @rtype: None
+
+    >>> _check_overlaps([(['A'], '0.shard'), (['B', 'C'], '1.shard')])
+    >>> _check_overlaps([(['A', 'B'], '0.shard'), (['A'], '1.shard')])
+    Traceback (most recent call last):
+    ...
+    ValueError: shard 0.shard of A/B overlaps shard 1.shard of A
+    """
+    # Once sorted, a path is directly followed by the paths inside it.
+    ordered = sorted(shard_names)
+    for i in range(1, len(ordered)):
+        outer, outer_path = ordered[i - 1]
+        inner, inner_path = ordered[i]
+        if inner[:len(outer)] == outer:
+            raise ValueError('shard {} of {} overlaps shard {} of {}'.format(
+                inner_path, '/'.join(inner), outer_path, '/'.join(outer)))
+
+
+def _wait(process):
+    """Wait for the shard scan <process> to finish.
+
+    @type process: subprocess.Popen
+    @rtype: None
+    """
+    if process.wait() != 0:
+        raise RuntimeError('shard scan {} failed'.format(process.args))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) in (4, 5) and sys.argv[1] == 'scan':
+        scan_shard(sys.argv[2], sys.argv[3],
+                   **json.loads(sys.argv[4] if len(sys.argv) == 5 else '{}'))
+    else:
+        sys.exit('usage: python shard.py scan <path> <shard file> '
+                 '[<options>]')
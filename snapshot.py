@@ -0,0 +1,360 @@
+"""Treemap Snapshots
+
+=== Module Description ===
+This module saves AbstractTrees to snapshot files and loads them back, so
+that a scan can be kept and compared with later scans of the same root
+(see tree_diff.py).
+
+A snapshot is a text file. The first line is a JSON header with the
+snapshot version, the separator of the saved tree and an optional
+description of where the tree came from. Every following line is one node
+of the tree, in preorder, as four tab-separated fields:
+
+    depth   data_size   kind   name
+
+where kind is 'f' for a leaf and 'd' for a tree with subtrees, and tabs,
+newlines and backslashes in the name are escaped with a backslash.
+The subtrees of each node are saved sorted by name, so that two snapshots
+can be matched node by node while they are being read.
+
+SnapshotTree.from_arrays builds a tree from flat arrays of the parent, name
+and size of every node, for the importers of tree_builder.py.
+
+Both saving and loading are iterative, so trees of any depth are supported,
+and records are streamed rather than held in memory.
+"""
+import json
+from random import getrandbits
+
+from tree_data import AbstractTree
+
+
+# The version written in the header of new snapshots.
+SNAPSHOT_VERSION = 1
+
+# Kinds of nodes in a snapshot record.
+LEAF = 'f'
+FOLDER = 'd'
+
+_ESCAPES = {'\\': '\\\\', '\t': '\\t', '\n': '\\n'}
+_UNESCAPES = {'\\': '\\', 't': '\t', 'n': '\n'}
+
+
+class SnapshotTree(AbstractTree):
+    """A tree loaded from a snapshot, or built from snapshot records.
+
+    === Private Attributes ===
+    @type _separator: str
+        The separator of the tree the snapshot was taken from.
+    """
+    def __init__(self, root, subtrees, data_size=0, separator='/'):
+        """Initialize a new SnapshotTree.
+
+        The first three arguments are passed to the AbstractTree constructor.
+
+        @type self: SnapshotTree
+        @type root: object
+        @type subtrees: list[SnapshotTree]
+        @type data_size: int
+        @type separator: str
+        @rtype: None
+        """
+        AbstractTree.__init__(self, root, subtrees, data_size)
+        self._separator = separator
+
+    def get_separator(self):
+        """Return the string used to separate nodes in the string
+        representation of a path from the tree root to a leaf.
+
+        @type self: SnapshotTree
+        @rtype: str
+        """
+        return self._separator
+
+    @classmethod
+    def from_arrays(cls, parents, names, sizes, separator='/'):
+        """Return the tree described by the arrays <parents>, <names> and
+        <sizes>, without going through the constructor for every node.
+
+        Node i is named names[i] and has the size sizes[i] if it is a leaf.
+        Its parent is node parents[i], or none if parents[i] is -1. The
+        subtrees of each node are in index order. The nodes can be in any
+        order.
+
+        Precondition: the arrays have the same, non-zero length, and describe
+        a single tree, whose root is the only node with parent -1.
+
+        @type parents: sequence[int]
+        @type names: sequence[str]
+        @type sizes: sequence[int]
+        @type separator: str
+        @rtype: SnapshotTree
+
+        >>> tree = SnapshotTree.from_arrays([-1, 0, 0, 1],
+        ...                                 ['B', 'A', 'f4', 'f1'],
+        ...                                 [0, 0, 10, 15])
+        >>> tree.data_size
+        25
+        >>> [t.treename() for t in tree.subtrees()]
+        ['A', 'f4']
+        >>> tree.subtrees()[0].subtrees()[0].get_parent().treename()
+        'A'
+        """
+        # Create and link the nodes, setting their attributes directly.
+        nodes = []
+        root = None
+        for i in range(len(names)):
+            node = cls.__new__(cls)
+            node._root = names[i]
+            node._subtrees = []
+            node._parent_tree = None
+            node._separator = separator
+            node.data_size = sizes[i]
+            nodes.append(node)
+        for i in range(len(nodes)):
+            parent = parents[i]
+            if parent < 0:
+                root = nodes[i]
+            else:
+                nodes[i]._parent_tree = nodes[parent]
+                nodes[parent].subtrees().append(nodes[i])
+
+        # Add up the sizes of the folders, children first, and colour the
+        # leaves.
+        stack = [(root, False)]
+        while len(stack) != 0:
+            node, ready = stack.pop()
+            if len(node.subtrees()) == 0:
+                bits = getrandbits(24)
+                node.color = (bits >> 16, (bits >> 8) & 255, bits & 255)
+            elif ready:
+                total = 0
+                for subtree in node.subtrees():
+                    total += subtree.data_size
+                node.data_size = total
+            else:
+                stack.append((node, True))
+                for subtree in node.subtrees():
+                    stack.append((subtree, False))
+        return root
+
+
+def tree_records(tree):
+    """Yield the snapshot records of <tree>: one (depth, data_size, kind,
+    name) tuple per node, in preorder, with the subtrees of each node sorted
+    by name.
+
+    @type tree: AbstractTree
+    @rtype: generator
+    """
+    stack = [(tree, 0)]
+    while len(stack) != 0:
+        subtree, depth = stack.pop()
+        children = subtree.subtrees()
+        if len(children) == 0:
+            yield depth, subtree.data_size, LEAF, str(subtree.treename())
+        else:
+            yield depth, subtree.data_size, FOLDER, str(subtree.treename())
+            # Push in reverse so the subtrees come out sorted by name.
+            for child in sorted(children, key=_name_key, reverse=True):
+                stack.append((child, depth + 1))
+
+
+def save_snapshot(tree, path, source=None):
+    """Save <tree> to a snapshot file at <path>.
+
+    <source> describes where the tree came from (e.g. the scanned path).
+
+    @type tree: AbstractTree
+    @type path: str
+    @type source: str | None
+    @rtype: None
+    """
+    header = {'version': SNAPSHOT_VERSION,
+              'separator': tree.get_separator(),
+              'source': source}
+    write_snapshot(tree_records(tree), header, path)
+
+
+def write_snapshot(records, header, path):
+    """Write the snapshot <records> with the given <header> to <path>.
+
+    @type records: iterable[(int, int, str, str)]
+    @type header: dict
+    @type path: str
+    @rtype: None
+    """
+    with open(path, 'w', encoding='utf-8', errors='surrogateescape',
+              newline='\n') as f:
+        f.write(json.dumps(header) + '\n')
+        for depth, size, kind, name in records:
+            f.write(format_record(depth, size, kind, name))
+
+
+def read_snapshot(path):
+    """Open the snapshot file at <path>.
+
+    Return its header, and a generator of its (depth, data_size, kind, name)
+    records. The file is closed once the generator is exhausted.
+
+    @type path: str
+    @rtype: (dict, generator)
+    """
+    # The file stays open for the generator, so it is only closed here if
+    # the header cannot be read.
+    f = open(path, encoding='utf-8', errors='surrogateescape', newline='\n')
+    try:
+        header = json.loads(f.readline())
+        if not isinstance(header, dict) or \
+                header.get('version') != SNAPSHOT_VERSION:
+            raise ValueError('{} is not a version {} snapshot'.format(
+                path, SNAPSHOT_VERSION))
+    except BaseException:
+        f.close()
+        raise
+    return header, _read_records(f)
+
+
+def load_snapshot(path):
+    """Load the snapshot file at <path> as a SnapshotTree.
+
+    @type path: str
+    @rtype: SnapshotTree
+    """
+    header, records = read_snapshot(path)
+    return build_tree(records, header['separator'])
+
+
+def build_tree(records, separator):
+    """Return the SnapshotTree described by the snapshot <records>.
+
+    Precondition: <records> is not empty, and is in preorder with a single
+    record of depth 0 first.
+
+    @type records: iterable[(int, int, str, str)]
+    @type separator: str
+    @rtype: SnapshotTree
+    """
+    # Each stack entry is (name, depth, subtrees) for a tree whose subtrees
+    # are still being read.
+    stack = []
+    result = None
+    for depth, size, kind, name in records:
+        while len(stack) != 0 and stack[-1][1] >= depth:
+            result = _close(stack, separator)
+        if kind == FOLDER:
+            stack.append((name, depth, []))
+        elif len(stack) == 0:  # the whole tree is a single leaf
+            return SnapshotTree(name, [], size, separator)
+        else:
+            stack[-1][2].append(SnapshotTree(name, [], size, separator))
+    while len(stack) != 0:
+        result = _close(stack, separator)
+    return result
+
+
+def format_record(depth, size, kind, name):
+    """Return the line of a snapshot file holding the given record.
+
+    @type depth: int
+    @type size: int
+    @type kind: str
+    @type name: str
+    @rtype: str
+
+    >>> format_record(1, 15, LEAF, 'f\\t1')
+    '1\\t15\\tf\\tf\\\\t1\\n'
+    """
+    return '{}\t{}\t{}\t{}\n'.format(depth, size, kind, _escape(name))
+
+
+def parse_record(line):
+    """Return the (depth, data_size, kind, name) record held by <line>, a
+    line of a snapshot file with or without its newline.
+
+    @type line: str
+    @rtype: (int, int, str, str)
+
+    >>> parse_record(format_record(1, 15, LEAF, 'f\\t1'))
+    (1, 15, 'f', 'f\\t1')
+    """
+    depth, size, kind, name = line.rstrip('\n').split('\t', 3)
+    if '\\' in name:
+        name = _unescape(name)
+    return int(depth), int(size), kind, name
+
+
+def _close(stack, separator):
+    """Pop the top entry of <stack>, build its SnapshotTree, add it to the
+    subtrees of the entry below it (if any) and return it.
+
+    @type stack: list[(str, int, list[SnapshotTree])]
+    @type separator: str
+    @rtype: SnapshotTree
+    """
+    name, _, subtrees = stack.pop()
+    tree = SnapshotTree(name, subtrees, 0, separator)
+    if len(stack) != 0:
+        stack[-1][2].append(tree)
+    return tree
+
+
+def _read_records(f):
+    """Yield the records of the open snapshot file <f>, then close it.
+
+    @type f: file
+    @rtype: generator
+    """
+    with f:
+        for line in f:
+            yield parse_record(line)
+
+
+def _name_key(tree):
+    """Return the key subtrees are sorted by in a snapshot.
+
+    @type tree: AbstractTree
+    @rtype: str
+    """
+    return str(tree.treename())
+
+
+def _escape(name):
+    """Return <name> with tabs, newlines and backslashes escaped.
+
+    @type name: str
+    @rtype: str
+
+    >>> _escape('a\\tb\\\\c')
+    'a\\\\tb\\\\\\\\c'
+    """
+    if '\\' not in name and '\t' not in name and '\n' not in name:
+        return name
+    return ''.join(_ESCAPES.get(c, c) for c in name)
+
+
+def _unescape(name):
+    """Return <name> with the escapes of _escape undone.
+
+    @type name: str
+    @rtype: str
+
+    >>> _unescape(_escape('a\\tb\\\\c\\nd'))
+    'a\\tb\\\\c\\nd'
+    """
+    chars = []
+    i = 0
+    while i < len(name):
+        if name[i] == '\\' and i + 1 < len(name):
+            chars.append(_UNESCAPES.get(name[i + 1], name[i + 1]))
+            i += 2
+        else:
+            chars.append(name[i])
+            i += 1
+    return ''.join(chars)
+
+
+if __name__ == '__main__':
+    import python_ta
+    # Remember to change this to check_all when cleaning up your code.
+    python_ta.check_errors(config='pylintrc.txt')
@@ -0,0 +1,297 @@
+"""Memory Bounded File System Scans
+
+=== Module Description ===
+This module scans file systems too large for all of their nodes to stay in
+memory at once.
+
+A SpillingFileSystemTree is scanned like a FileSystemTree, but keeps count of
+the nodes it holds in memory. Whenever a folder is finished while that count
+is over the budget, the whole subtree of the folder is written to a
+SubtreeStore on disk and the folder is turned into a stub: a leaf holding
+the total size of the folder and the location of its subtree in the store.
+The treemap of a tree with stubs draws each stub as a single rectangle.
+
+Calling expand on a stub pages its subtree back in from the store. Stubs
+written before their parent was spilled are stored as stubs again, so each
+expansion only loads one level of spilled subtrees. The store stays open
+until the tree is closed.
+
+At most the budget, plus the entries of the folders still being listed, are
+in memory during a scan, however many files there are in total. To keep it
+that way, the scan only remembers the folders it is still scanning (and
+those reached through symbolic links) to skip cycles, so a folder reached
+through a symbolic link after it was scanned directly is scanned again.
+
+The store uses the record format of snapshot files (see snapshot.py), with
+one more kind of record for stubs: STUB followed by the location of their
+subtree.
+"""
+import tempfile
+from random import randint
+
+import instrumentation
+from snapshot import FOLDER, LEAF, format_record, parse_record
+from tree_data import AbstractTree, FileSystemTree
+
+
+# The default number of nodes a SpillingFileSystemTree keeps in memory.
+DEFAULT_MAX_RESIDENT_NODES = 1000000
+
+# The kind of the snapshot records of stubs.
+STUB = 's'
+
+
+class SubtreeStore:
+    """An append-only file of spilled subtrees, as snapshot records.
+
+    The location of a subtree in the store is the (offset, length) in bytes
+    of its records.
+
+    === Private Attributes ===
+    @type _file: file
+        The binary file the records are stored in.
+    """
+    def __init__(self, path=None):
+        """Initialize a new empty store, in the file at <path>, or in a
+        temporary file deleted when the store is closed if <path> is None.
+
+        @type self: SubtreeStore
+        @type path: str | None
+        @rtype: None
+        """
+        if path is None:
+            self._file = tempfile.TemporaryFile()
+        else:
+            self._file = open(path, 'w+b')
+
+    def write(self, records):
+        """Append <records> to this store, and return their location.
+
+        @type self: SubtreeStore
+        @type records: iterable[(int, int, str, str)]
+        @rtype: (int, int)
+        """
+        lines = [format_record(depth, size, kind, name)
+                 for depth, size, kind, name in records]
+        data = ''.join(lines).encode('utf-8', 'surrogateescape')
+        offset = self._file.seek(0, 2)
+        self._file.write(data)
+        return offset, len(data)
+
+    def read(self, location):
+        """Return the records stored at <location>.
+
+        @type self: SubtreeStore
+        @type location: (int, int)
+        @rtype: list[(int, int, str, str)]
+        """
+        offset, length = location
+        self._file.seek(offset)
+        data = self._file.read(length).decode('utf-8', 'surrogateescape')
+        return [parse_record(line) for line in data.splitlines()]
+
+    def close(self):
+        """Close this store. Stubs can no longer be expanded afterwards.
+
+        @type self: SubtreeStore
+        @rtype: None
+        """
+        self._file.close()
+
+
+class SpillingFileSystemTree(FileSystemTree):
+    """A FileSystemTree that moves finished folders to disk to stay within
+    a budget of nodes in memory.
+
+    The folders moved to disk are left in the tree as stubs, which have no
+    subtrees until they are expanded.
+
+    === Public Attributes ===
+    @type resident_nodes: int
+        The number of nodes of this tree in memory at the end of the scan,
+        not counting expanded stubs. Only set on the root.
+
+    === Private Attributes ===
+    @type _store: SubtreeStore | None
+        The store holding the subtree of this stub, or of the stubs of this
+        tree for the root; None for other nodes.
+    @type _location: (int, int) | None
+        The location of the subtree of this stub in the store, or None if
+        this tree is not a stub.
+    @type _max_resident_nodes: int
+        The budget of nodes in memory. Only set on the root.
+    @type _resident: dict[int, int]
+        The number of nodes in memory in each finished folder whose parent is
+        not finished yet, by id. Only used during the scan.
+    """
+    _store = None
+    _location = None
+
+    def __init__(self, path, max_resident_nodes=DEFAULT_MAX_RESIDENT_NODES,
+                 store_path=None, **options):
+        """Scan the given file or folder, keeping at most about
+        <max_resident_nodes> nodes in memory, and storing the rest in a
+        store at <store_path> (or in a temporary file if it is None).
+
+        <options> are passed on to the FileSystemTree constructor.
+
+        @type self: SpillingFileSystemTree
+        @type path: str
+        @type max_resident_nodes: int
+        @type store_path: str | None
+        @rtype: None
+        """
+        self._store = SubtreeStore(store_path)
+        self._max_resident_nodes = max_resident_nodes
+        self._resident = {}
+        self.resident_nodes = 1
+        FileSystemTree.__init__(self, path, **options)
+        self._resident = {}
+
+    def stub(self, store, location):
+        """Turn this tree into a stub whose subtree is at <location> in
+        <store>. Its subtrees are dropped from memory.
+
+        @type self: SpillingFileSystemTree
+        @type store: SubtreeStore
+        @type location: (int, int)
+        @rtype: None
+        """
+        self._store = store
+        self._location = location
+        self._subtrees = []
+        self.color = (randint(0, 255), randint(0, 255), randint(0, 255))
+
+    def stub_location(self):
+        """Return the location of the subtree of this stub in its store, or
+        None if this tree is not a stub.
+
+        @type self: SpillingFileSystemTree
+        @rtype: (int, int) | None
+        """
+        return self._location
+
+    def is_stub(self):
+        """Return whether this tree is a stub, whose subtree is on disk.
+
+        @type self: SpillingFileSystemTree
+        @rtype: bool
+        """
+        return self._location is not None
+
+    def expand(self):
+        """Load the subtrees of this stub back into memory. The subtrees that
+        were stubs when it was spilled are stubs again.
+
+        Do nothing if this tree is not a stub.
+
+        @type self: SpillingFileSystemTree
+        @rtype: None
+        """
+        if self._location is None:
+            return
+        with instrumentation.phase('page_in'):
+            records = self._store.read(self._location)
+            # Each stack entry is (tree, name, depth, subtrees) for a folder
+            # whose subtrees are still being read.
+            stack = [(self, self._root, 0, [])]
+            for depth, size, kind, name in records[1:]:
+                while stack[-1][2] >= depth:
+                    self._close_folder(stack)
+                subtree = type(self).__new__(type(self))
+                if kind == FOLDER:
+                    stack.append((subtree, name, depth, []))
+                    continue
+                AbstractTree.__init__(subtree, name, [], size)
+                if kind != LEAF:  # a stub
+                    offset, length = kind[len(STUB):].split(',')
+                    subtree.stub(self._store, (int(offset), int(length)))
+                stack[-1][3].append(subtree)
+            while len(stack) > 1:
+                self._close_folder(stack)
+            parent = self._parent_tree
+            AbstractTree.__init__(self, self._root, stack[0][3])
+            self._parent_tree = parent
+            del self._store
+            del self._location
+        instrumentation.count('nodes_paged_in', len(records) - 1)
+
+    def close(self):
+        """Close the store of this tree, and delete it if it is a temporary
+        file. The stubs of this tree can no longer be expanded afterwards.
+
+        @type self: SpillingFileSystemTree
+        @rtype: None
+        """
+        self._store.close()
+
+    def _scan(self, scanner, path):
+        """Store the file tree structure at <path>, as scanned by <scanner>,
+        which only remembers the folders it still needs to skip cycles.
+
+        @type self: SpillingFileSystemTree
+        @type scanner: _FileSystemScanner
+        @type path: str
+        @rtype: None
+        """
+        scanner.forget_finished_folders()
+        FileSystemTree._scan(self, scanner, path)
+
+    def _folder_scanned(self, folder):
+        """Count the nodes in memory in <folder>, and spill it to the store
+        if there are too many nodes in memory.
+
+        @type self: SpillingFileSystemTree
+        @type folder: SpillingFileSystemTree
+        @rtype: None
+        """
+        resident = 1
+        for subtree in folder.subtrees():
+            resident += self._resident.pop(id(subtree), 1)
+        self.resident_nodes += len(folder.subtrees())
+        if self.resident_nodes > self._max_resident_nodes and \
+                folder is not self and resident > 1:
+            folder.stub(self._store, self._store.write(_spill_records(folder)))
+            self.resident_nodes -= resident - 1
+            instrumentation.count('subtrees_spilled')
+            resident = 1
+        self._resident[id(folder)] = resident
+
+    @staticmethod
+    def _close_folder(stack):
+        """Pop the top entry of <stack>, initialize its folder and add it to
+        the subtrees of the entry below it.
+
+        @type stack: list[(SpillingFileSystemTree, str, int, list)]
+        @rtype: None
+        """
+        folder, name, _, subtrees = stack.pop()
+        AbstractTree.__init__(folder, name, subtrees)
+        stack[-1][3].append(folder)
+
+
+def _spill_records(folder):
+    """Yield the store records of the subtree of <folder>, in preorder.
+
+    @type folder: SpillingFileSystemTree
+    @rtype: generator
+    """
+    stack = [(folder, 0)]
+    while len(stack) != 0:
+        subtree, depth = stack.pop()
+        if subtree.is_stub():
+            yield depth, subtree.data_size, \
+                '{}{},{}'.format(STUB, *subtree.stub_location()), \
+                subtree.treename()
+        elif len(subtree.subtrees()) == 0:
+            yield depth, subtree.data_size, LEAF, subtree.treename()
+        else:
+            yield depth, subtree.data_size, FOLDER, subtree.treename()
+            for child in reversed(subtree.subtrees()):
+                stack.append((child, depth + 1))
+
+
+if __name__ == '__main__':
+    import python_ta
+    # Remember to change this to check_all when cleaning up your code.
+    python_ta.check_errors(config='pylintrc.txt')
@@ -0,0 +1,404 @@
+"""Tiled Treemap Rendering
+
+=== Module Description ===
+This module draws treemaps far larger than the screen (e.g. 16k-pixel
+posters) as square tiles, the way online maps do, and serves them to a web
+browser over a small local HTTP server.
+
+The layout of the tree is computed once, in normalized coordinates (see
+layout.py). A tile is only drawn when it is asked for, and only the subtrees
+that overlap it are visited. Drawn tiles are kept as PNG images in a cache
+of bounded size, which drops the least recently used tiles first.
+
+Tiles are addressed by zoom level and position, (zoom, x, y). At the highest
+zoom level the treemap is drawn at its full size; every lower level halves
+its width and height, down to level 0 where it fits in a single tile.
+"""
+import io
+import json
+import math
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pygame
+from layout import NormalizedLayout
+
+
+# The width and height of a tile, in pixels.
+TILE_SIZE = 256
+
+# The default size of the tile cache, in bytes.
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+# The page served at / to view the tiles. INFO is replaced by the JSON
+# description of the treemap (see TileRenderer.info).
+VIEWER_HTML = '''<!DOCTYPE html>
+<html>
+<head>
+<title>Treemap</title>
+<style>
+  body { margin: 0; background: black; }
+  #map { position: absolute; top: 0; left: 0; right: 0; bottom: 0;
+         overflow: hidden; cursor: move; }
+  #map img { position: absolute; }
+</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+var info = INFO;
+var map = document.getElementById('map');
+var zoom = 0, viewLeft = 0, viewTop = 0, dragging = null;
+
+function levelSize(level) {
+  var scale = Math.pow(2, info.max_zoom - level);
+  return [Math.ceil(info.width / scale), Math.ceil(info.height / scale)];
+}
+
+function draw() {
+  var size = levelSize(zoom), tile = info.tile_size;
+  map.innerHTML = '';
+  var x0 = Math.max(0, Math.floor(viewLeft / tile));
+  var y0 = Math.max(0, Math.floor(viewTop / tile));
+  var x1 = Math.min(Math.ceil(size[0] / tile),
+                    Math.ceil((viewLeft + map.clientWidth) / tile));
+  var y1 = Math.min(Math.ceil(size[1] / tile),
+                    Math.ceil((viewTop + map.clientHeight) / tile));
+  for (var y = y0; y < y1; y++) {
+    for (var x = x0; x < x1; x++) {
+      var img = document.createElement('img');
+      img.src = '/tiles/' + zoom + '/' + x + '/' + y + '.png';
+      img.style.left = (x * tile - viewLeft) + 'px';
+      img.style.top = (y * tile - viewTop) + 'px';
+      map.appendChild(img);
+    }
+  }
+}
+
+map.onmousedown = function (e) { dragging = [e.clientX, e.clientY]; };
+window.onmouseup = function () { dragging = null; };
+window.onmousemove = function (e) {
+  if (dragging) {
+    viewLeft -= e.clientX - dragging[0];
+    viewTop -= e.clientY - dragging[1];
+    dragging = [e.clientX, e.clientY];
+    draw();
+  }
+};
+map.onwheel = function (e) {
+  e.preventDefault();
+  var level = Math.max(0, Math.min(info.max_zoom,
+                                   zoom + (e.deltaY < 0 ? 1 : -1)));
+  var factor = Math.pow(2, level - zoom);
+  viewLeft = (viewLeft + e.clientX) * factor - e.clientX;
+  viewTop = (viewTop + e.clientY) * factor - e.clientY;
+  zoom = level;
+  draw();
+};
+window.onresize = draw;
+draw();
+</script>
+</body>
+</html>
+'''
+
+
+class TileCache:
+    """A cache of drawn tiles, bounded by the total size of their images.
+
+    === Private Attributes ===
+    @type _max_bytes: int
+        The most bytes of images the cache holds.
+    @type _bytes: int
+        The bytes of images the cache holds now.
+    @type _tiles: OrderedDict[(int, int, int), bytes]
+        The cached images by (zoom, x, y), least recently used first.
+    """
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        """Initialize a new empty cache holding up to <max_bytes> bytes.
+
+        @type self: TileCache
+        @type max_bytes: int
+        @rtype: None
+        """
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self._tiles = OrderedDict()
+
+    def __len__(self):
+        """Return the number of tiles in this cache.
+
+        @type self: TileCache
+        @rtype: int
+        """
+        return len(self._tiles)
+
+    def get(self, key):
+        """Return the image of the tile <key>, or None if it is not cached.
+
+        @type self: TileCache
+        @type key: (int, int, int)
+        @rtype: bytes | None
+        """
+        image = self._tiles.get(key)
+        if image is not None:
+            self._tiles.move_to_end(key)
+        return image
+
+    def put(self, key, image):
+        """Cache <image> as the image of the tile <key>, and drop the least
+        recently used tiles until the cache fits in its size.
+
+        @type self: TileCache
+        @type key: (int, int, int)
+        @type image: bytes
+        @rtype: None
+
+        >>> cache = TileCache(10)
+        >>> cache.put((0, 0, 0), b'123456')
+        >>> cache.put((1, 0, 0), b'123456')
+        >>> cache.get((0, 0, 0)) is None
+        True
+        >>> cache.get((1, 0, 0))
+        b'123456'
+        """
+        old = self._tiles.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old)
+        self._tiles[key] = image
+        self._bytes += len(image)
+        while self._bytes > self._max_bytes and len(self._tiles) > 1:
+            _, dropped = self._tiles.popitem(last=False)
+            self._bytes -= len(dropped)
+
+
+class TileRenderer:
+    """Draws the tiles of the treemap of a tree.
+
+    === Public Attributes ===
+    @type width: int
+    @type height: int
+        The size of the treemap at the highest zoom level, in pixels.
+    @type max_zoom: int
+        The highest zoom level.
+    @type cache: TileCache
+        The tiles drawn so far.
+
+    === Private Attributes ===
+    @type _layout: NormalizedLayout
+        The layout of the tree.
+    """
+    def __init__(self, tree, width, height, cache_bytes=DEFAULT_CACHE_BYTES):
+        """Initialize a renderer of the treemap of <tree>, which is <width> x
+        <height> pixels at the highest zoom level.
+
+        @type self: TileRenderer
+        @type tree: AbstractTree
+        @type width: int
+        @type height: int
+        @type cache_bytes: int
+        @rtype: None
+        """
+        self.width = width
+        self.height = height
+        self.max_zoom = max(0, math.ceil(math.log2(max(width, height) /
+                                                   TILE_SIZE)))
+        self.cache = TileCache(cache_bytes)
+        self._layout = NormalizedLayout(tree, width / height)
+
+    def level_size(self, zoom):
+        """Return the width and height of the treemap at <zoom>, in pixels.
+
+        @type self: TileRenderer
+        @type zoom: int
+        @rtype: (int, int)
+        """
+        scale = 2 ** (self.max_zoom - zoom)
+        return math.ceil(self.width / scale), math.ceil(self.height / scale)
+
+    def has_tile(self, zoom, x, y):
+        """Return whether there is a tile at (<x>, <y>) at <zoom>, i.e.
+        whether it overlaps the treemap.
+
+        @type self: TileRenderer
+        @type zoom: int
+        @type x: int
+        @type y: int
+        @rtype: bool
+        """
+        if not 0 <= zoom <= self.max_zoom:
+            return False
+        width, height = self.level_size(zoom)
+        return 0 <= x < math.ceil(width / TILE_SIZE) and \
+            0 <= y < math.ceil(height / TILE_SIZE)
+
+    def info(self):
+        """Return a description of the treemap for the tile viewer.
+
+        @type self: TileRenderer
+        @rtype: dict
+        """
+        return {'width': self.width, 'height': self.height,
+                'max_zoom': self.max_zoom, 'tile_size': TILE_SIZE}
+
+    def tile(self, zoom, x, y):
+        """Return the PNG image of the tile at (<x>, <y>) at <zoom>, drawing
+        it if it is not cached.
+
+        Precondition: self.has_tile(zoom, x, y).
+
+        @type self: TileRenderer
+        @type zoom: int
+        @type x: int
+        @type y: int
+        @rtype: bytes
+        """
+        key = (zoom, x, y)
+        image = self.cache.get(key)
+        if image is None:
+            image = _encode_png(self.draw_tile(zoom, x, y))
+            self.cache.put(key, image)
+        return image
+
+    def draw_tile(self, zoom, x, y):
+        """Draw the tile at (<x>, <y>) at <zoom> on a new surface.
+
+        @type self: TileRenderer
+        @type zoom: int
+        @type x: int
+        @type y: int
+        @rtype: pygame.Surface
+        """
+        surface = pygame.Surface((TILE_SIZE, TILE_SIZE))
+        surface.fill(pygame.color.THECOLORS['black'])
+        width, height = self.level_size(zoom)
+        left = x * TILE_SIZE
+        top = y * TILE_SIZE
+        for rect, colour in self._layout.visible_leaves(
+                left, top, left + TILE_SIZE, top + TILE_SIZE, width, height):
+            rect_x, rect_y, rect_width, rect_height = rect
+            pygame.draw.rect(surface, colour, (rect_x - left, rect_y - top,
+                                               rect_width, rect_height))
+        return surface
+
+
+def serve_tiles(renderer, port=8000):
+    """Serve the tiles of <renderer> and a page to view them at
+    http://localhost:<port>/ until interrupted.
+
+    @type renderer: TileRenderer
+    @type port: int
+    @rtype: None
+    """
+    server = HTTPServer(('127.0.0.1', port), _make_handler(renderer))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def run_tile_server(tree, width, height, port=8000):
+    """Serve a <width> x <height> tiled treemap of <tree> on <port>.
+
+    @type tree: AbstractTree
+    @type width: int
+    @type height: int
+    @type port: int
+    @rtype: None
+    """
+    serve_tiles(TileRenderer(tree, width, height), port)
+
+
+def _make_handler(renderer):
+    """Return an HTTP request handler class serving the tiles of <renderer>.
+
+    @type renderer: TileRenderer
+    @rtype: type
+    """
+    class TileHandler(BaseHTTPRequestHandler):
+        """Serves the viewer page at / and tiles at /tiles/<z>/<x>/<y>.png.
+        """
+        def do_GET(self):
+            """Respond to a GET request.
+
+            @type self: TileHandler
+            @rtype: None
+            """
+            if self.path == '/':
+                page = VIEWER_HTML.replace('INFO', json.dumps(renderer.info()))
+                self._respond('text/html', page.encode())
+                return
+            tile = _parse_tile_path(self.path, renderer.max_zoom)
+            if tile is None or not renderer.has_tile(*tile):
+                self.send_error(404)
+            else:
+                self._respond('image/png', renderer.tile(*tile))
+
+        def _respond(self, content_type, body):
+            """Send a successful response with the given <body>.
+
+            @type self: TileHandler
+            @type content_type: str
+            @type body: bytes
+            @rtype: None
+            """
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            """Do not log every request.
+
+            @type self: TileHandler
+            @rtype: None
+            """
+            pass
+
+    return TileHandler
+
+
+def _parse_tile_path(path, max_zoom):
+    """Return the (zoom, x, y) of the tile at the URL path <path>, or None if
+    it is not the path of a tile.
+
+    @type path: str
+    @type max_zoom: int
+    @rtype: (int, int, int) | None
+
+    >>> _parse_tile_path('/tiles/2/3/1.png', 4)
+    (2, 3, 1)
+    >>> _parse_tile_path('/tiles/9/0/0.png', 4) is None
+    True
+    """
+    parts = path.split('/')
+    if len(parts) != 5 or parts[1] != 'tiles' or \
+            not parts[4].endswith('.png'):
+        return None
+    try:
+        zoom, x, y = int(parts[2]), int(parts[3]), int(parts[4][:-4])
+    except ValueError:
+        return None
+    if not 0 <= zoom <= max_zoom or x < 0 or y < 0:
+        return None
+    return zoom, x, y
+
+
+def _encode_png(surface):
+    """Return <surface> encoded as a PNG image.
+
+    @type surface: pygame.Surface
+    @rtype: bytes
+    """
+    buffer = io.BytesIO()
+    pygame.image.save(surface, buffer, 'tile.png')
+    return buffer.getvalue()
+
+
+if __name__ == '__main__':
+    import python_ta
+    # Remember to change this to check_all when cleaning up your code.
+    python_ta.check_errors(config='pylintrc.txt')
@@ -0,0 +1,293 @@
+"""Bulk Tree Building and Importers
+
+=== Module Description ===
+This module builds trees for the treemap visualiser from data produced by
+other tools, without creating every node through AbstractTree.__init__.
+
+The importers read their input as a stream, one line (or one JSON token) at
+a time, and only keep compact arrays of the parent, name and size of every
+node, from which SnapshotTree.from_arrays builds the whole tree at once:
+
+- import_du reads the output of `du -ab`, where every folder comes right
+  after its contents. It only keeps the nodes whose parent has not been
+  read yet, so it needs no lookup table of paths.
+- import_listing reads CSV or TSV listings of (path, size) rows, in any
+  order.
+- import_json reads nested JSON objects with "name", "size" (or "value")
+  and "children" keys, as used by d3 and similar tools.
+
+The trees built are SnapshotTrees (see snapshot.py). As usual, the data_size
+of a tree with subtrees is the sum of the data_size of its subtrees; the
+sizes given for folders in the input are ignored.
+"""
+import csv
+import json
+import re
+from array import array
+
+from snapshot import SnapshotTree
+
+
+# The number of characters read from a JSON file at a time.
+JSON_CHUNK_SIZE = 1024 * 1024
+
+_JSON_TOKEN = re.compile(r'''
+    \s*(?:
+      ("(?:[^"\\]|\\.)*")                        # a string
+    | (-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)         # a number
+    | (true|false|null)                          # a literal
+    | ([{}\[\]:,])                               # punctuation
+    )''', re.VERBOSE)
+
+
+def import_du(source, separator='/'):
+    """Return the tree described by the output of `du -ab` in <source>.
+
+    Each line of <source> is a size and a path separated by a tab, and every
+    folder is listed right after its contents, as du does. The root is the
+    last line.
+
+    @type source: str | file
+        A file name, or an open text file.
+    @type separator: str
+    @rtype: SnapshotTree
+
+    >>> import io
+    >>> lines = io.StringIO('15\\t./A/f1\\n5\\t./A/f2\\n4096\\t./A\\n'
+    ...                     '10\\t./f4\\n4096\\t.\\n')
+    >>> tree = import_du(lines)
+    >>> tree.data_size
+    30
+    >>> [(t.treename(), t.data_size) for t in tree.subtrees()]
+    [('A', 20), ('f4', 10)]
+    """
+    parents = array('l')
+    sizes = array('q')
+    names = []
+    # The (depth, index) of the nodes whose parent has not been read yet.
+    # Since every folder comes right after its contents, the nodes on top
+    # one level deeper than a folder are exactly its subtrees.
+    pending = []
+    with _open(source) as f:
+        for line in f:
+            size, path = line.rstrip('\n').split('\t', 1)
+            path = path.rstrip(separator)
+            depth = path.count(separator)
+            index = len(names)
+            first_child = len(pending)
+            while first_child > 0 and pending[first_child - 1][0] == depth + 1:
+                first_child -= 1
+            for _, child in pending[first_child:]:
+                parents[child] = index
+            del pending[first_child:]
+            pending.append((depth, index))
+            parents.append(-1)
+            sizes.append(int(size))
+            names.append(path[path.rfind(separator) + 1:] or path)
+    return SnapshotTree.from_arrays(parents, names, sizes, separator)
+
+
+def import_listing(source, delimiter=',', separator='/', header=False):
+    """Return the tree described by the CSV listing in <source>.
+
+    Each row of <source> is a path and a size, separated by <delimiter>
+    (use '\\t' for TSV). The rows can be in any order; folders do not need
+    rows of their own. If <header> is True, the first row is skipped.
+
+    The root of the tree is the longest path that contains all the others.
+
+    @type source: str | file
+        A file name, or an open text file.
+    @type delimiter: str
+    @type separator: str
+    @type header: bool
+    @rtype: SnapshotTree
+
+    >>> import io
+    >>> rows = io.StringIO('B/A/f1,15\\nB/f4,10\\nB/A/f2,5\\n')
+    >>> tree = import_listing(rows)
+    >>> tree.treename(), tree.data_size
+    ('B', 30)
+    >>> [(t.treename(), t.data_size) for t in tree.subtrees()]
+    [('A', 20), ('f4', 10)]
+    """
+    parents = array('l', [-1])
+    sizes = array('q', [0])
+    names = ['']
+    index_of = {}  # (parent index, name) to index
+    with _open(source) as f:
+        rows = csv.reader(f, delimiter=delimiter)
+        if header:
+            next(rows, None)
+        for row in rows:
+            if len(row) < 2:
+                continue
+            node = 0  # a common root above every path
+            for name in row[0].strip(separator).split(separator):
+                key = (node, name)
+                child = index_of.get(key)
+                if child is None:
+                    child = len(names)
+                    index_of[key] = child
+                    parents.append(node)
+                    sizes.append(0)
+                    names.append(name)
+                node = child
+            sizes[node] = int(row[1])
+    del index_of
+    tree = SnapshotTree.from_arrays(parents, names, sizes, separator)
+    # Drop the common root while it has a single subtree, so the root is the
+    # longest common folder.
+    while len(tree.subtrees()) == 1 and len(tree.subtrees()[0].subtrees()) != 0:
+        tree = tree.subtrees()[0]
+        tree._parent_tree = None
+    return tree
+
+
+def import_json(source, separator='/'):
+    """Return the tree described by the nested JSON object in <source>.
+
+    Every object has a "name" and, if it has subtrees, a "children" list of
+    objects; leaves have a "size" (or "value"). Other keys are ignored.
+    The file is read a chunk at a time rather than all at once.
+
+    @type source: str | file
+        A file name, or an open text file.
+    @type separator: str
+    @rtype: SnapshotTree
+
+    >>> import io
+    >>> text = io.StringIO('{"name": "B", "children": [{"name": "A", '
+    ...                    '"children": [{"name": "f1", "size": 15}]}, '
+    ...                    '{"name": "f4", "value": 10, "x": [1, {}]}]}')
+    >>> tree = import_json(text)
+    >>> tree.data_size
+    25
+    >>> [(t.treename(), t.data_size) for t in tree.subtrees()]
+    [('A', 15), ('f4', 10)]
+    """
+    parents = array('l')
+    sizes = array('q')
+    names = []
+    with _open(source) as f:
+        tokens = _json_tokens(f)
+        # Each stack entry is the index of an object whose keys are being
+        # read, or -1 - index while the "children" of that object are.
+        stack = []
+        token = next(tokens)
+        while True:
+            if token == '{':  # a new node
+                parent = -1 if len(stack) == 0 else -1 - stack[-1]
+                stack.append(len(names))
+                parents.append(parent)
+                sizes.append(0)
+                names.append('')
+                token = next(tokens)
+            elif token == '}':  # the end of the current node
+                stack.pop()
+                if len(stack) == 0:
+                    break
+                token = next(tokens)
+            elif token == ']':  # the end of the children of the current node
+                stack[-1] = -1 - stack[-1]
+                token = next(tokens)
+            elif token == ',':
+                token = next(tokens)
+            elif stack[-1] < 0:
+                raise ValueError('expected an object, got {}'.format(token))
+            else:  # a key of the current object
+                key = _json_value(token)
+                if next(tokens) != ':':
+                    raise ValueError('expected : after {}'.format(token))
+                token = next(tokens)
+                if key == 'children' and token == '[':
+                    stack[-1] = -1 - stack[-1]
+                    token = next(tokens)
+                elif key == 'name':
+                    names[stack[-1]] = str(_json_value(token))
+                    token = next(tokens)
+                elif key == 'size' or key == 'value':
+                    sizes[stack[-1]] = int(_json_value(token))
+                    token = next(tokens)
+                else:
+                    token = _skip_json_value(token, tokens)
+    return SnapshotTree.from_arrays(parents, names, sizes, separator)
+
+
+def _open(source):
+    """Return <source> as an open text file: itself if it is already one,
+    or the file it names.
+
+    @type source: str | file
+    @rtype: file
+    """
+    if isinstance(source, str):
+        return open(source, encoding='utf-8', errors='surrogateescape',
+                    newline='')
+    return source
+
+
+def _json_tokens(f):
+    """Yield the JSON tokens of the open file <f>, reading it a chunk at a
+    time. Strings, numbers and literals are yielded as their JSON text.
+
+    @type f: file
+    @rtype: generator
+    """
+    buffer = ''
+    position = 0
+    finished = False
+    while True:
+        match = _JSON_TOKEN.match(buffer, position)
+        # A token that reaches the end of the buffer may continue in the
+        # next chunk, so read more before using it.
+        if (match is None or match.end() == len(buffer)) and not finished:
+            chunk = f.read(JSON_CHUNK_SIZE)
+            finished = len(chunk) == 0
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        if match is None:
+            if buffer[position:].strip() != '':
+                raise ValueError('invalid JSON near {!r}'.format(
+                    buffer[position:position + 20]))
+            return
+        position = match.end()
+        yield match.group(match.lastindex)
+
+
+def _json_value(token):
+    """Return the Python value of the JSON string, number or literal
+    <token>.
+
+    @type token: str
+    @rtype: object
+    """
+    if token[0] == '"' and '\\' not in token:
+        return token[1:-1]
+    return json.loads(token)
+
+
+def _skip_json_value(token, tokens):
+    """Skip the JSON value starting with <token>, and return the token after
+    it.
+
+    @type token: str
+    @type tokens: iterator[str]
+    @rtype: str
+    """
+    depth = 0
+    while True:
+        if token == '{' or token == '[':
+            depth += 1
+        elif token == '}' or token == ']':
+            depth -= 1
+        token = next(tokens)
+        if depth == 0:
+            return token
+
+
+if __name__ == '__main__':
+    import python_ta
+    # Remember to change this to check_all when cleaning up your code.
+    python_ta.check_errors(config='pylintrc.txt')
@@ -11,10 +11,15 @@ visualiser. You will both add to the abstract class, and complete a
 concrete implementation of a subclass to represent files and folders on your
 computer's file system.
 """
+import fnmatch
 import os
+import re
+import stat
 from random import randint
 import math
 
+import instrumentation
+
 
 class AbstractTree:
     """A tree that is compatible with the treemap visualiser.
@@ -151,38 +156,88 @@ class AbstractTree:
         >>> f1.generate_treemap((0, 0, 100, 200))
         []
         """
-        if self.data_size == 0:  # if the tree has size 0
-            return []
-        else:
-            x, y, width, height = rect  # extract coordinates of a rectangle
-            if len(self._subtrees) == 0:  # if the tree has a single leaf
-                return [((x, y, width, height), self.color)]
-            else:
-                new = []
-                curr_w = x
-                curr_h = y
-                sub_curr = 0  # set to use for the last rectangle
-                for i in range(0, len(self._subtrees)):
-                    proportion = self._subtrees[i].data_size / self.data_size
-                    if width > height:
-                        if i != len(self._subtrees) - 1:  # if it is not the last rectangle
-                            subwidth = int(proportion * width)
-                            sub_curr += subwidth
-                        else:  # if it is the last rectangle
-                            subwidth = int(width - sub_curr)
-                        new_rect = self._subtrees[i].generate_treemap((curr_w, y, subwidth, height))
-                        new.extend(new_rect)
-                        curr_w += subwidth
-                    else:  # width <= height
-                        if i != len(self._subtrees) - 1:  # if it is not the last rectangle
-                            subheight = int(proportion * height)
-                            sub_curr += subheight
-                        else:  # if it is the last rectangle
-                            subheight = int(height - sub_curr)
-                        new_rect = self._subtrees[i].generate_treemap((x, curr_h, width, subheight))
-                        new.extend(new_rect)
-                        curr_h += subheight
-                return new
+        rects = []
+        visited = 0
+        with instrumentation.phase('generate_treemap'):
+            # An explicit stack of iterators over (subtree, rectangle) pairs
+            # instead of one recursive call per level. The top iterator is
+            # resumed once the subtree it descended into is done.
+            stack = [iter([(self, rect)])]
+            while len(stack) != 0:
+                for tree, tree_rect in stack[-1]:
+                    visited += 1
+                    if tree.data_size == 0:  # if the tree has size 0
+                        continue
+                    if len(tree.subtrees()) == 0:  # a single leaf
+                        rects.append((tree_rect, tree.color))
+                    else:
+                        stack.append(tree.iter_subtree_rects(tree_rect))
+                        break
+                else:  # every subtree at this level is done
+                    stack.pop()
+        instrumentation.count('nodes_visited', visited)
+        return rects
+
+    def subtree_rects(self, rect):
+        """Split <rect> between the subtrees of this tree.
+
+        Return one (subtree, rectangle) pair per subtree, in subtree order.
+        Each subtree gets a slice of <rect> proportional to its data_size,
+        cut along the longer side; the last subtree takes whatever is left so
+        the slices exactly cover <rect>.
+
+        Precondition: this tree has subtrees and a non-zero data_size.
+
+        @type self: AbstractTree
+        @type rect: (int, int, int, int)
+        @rtype: list[(AbstractTree, (int, int, int, int))]
+
+        >>> a1 = AbstractTree('f1', [], 10)
+        >>> a2 = AbstractTree('f2', [], 30)
+        >>> a3 = AbstractTree('F1', [a1, a2], 0)
+        >>> [r for _, r in a3.subtree_rects((0, 0, 100, 50))]
+        [(0, 0, 25, 50), (25, 0, 75, 50)]
+        """
+        return list(self.iter_subtree_rects(rect))
+
+    def iter_subtree_rects(self, rect):
+        """Yield the (subtree, rectangle) pairs of subtree_rects one at a time,
+        so that a caller looking for one of them can stop early.
+
+        Every rectangle but the last gets its rounded-down proportion; the
+        last one takes whatever is left.
+
+        Precondition: this tree has subtrees and a non-zero data_size.
+
+        @type self: AbstractTree
+        @type rect: (int, int, int, int)
+        @rtype: generator
+
+        >>> a1 = AbstractTree('f1', [], 10)
+        >>> a2 = AbstractTree('f2', [], 30)
+        >>> a3 = AbstractTree('F1', [a1, a2], 0)
+        >>> [r for _, r in a3.iter_subtree_rects((0, 0, 50, 100))]
+        [(0, 0, 50, 25), (0, 25, 50, 75)]
+        """
+        x, y, width, height = rect
+        subtrees = self._subtrees
+        last = len(subtrees) - 1
+        total = self.data_size
+        if width > height:
+            curr_w = x
+            for i in range(last):
+                subwidth = int(subtrees[i].data_size / total * width)
+                yield subtrees[i], (curr_w, y, subwidth, height)
+                curr_w += subwidth
+            yield subtrees[last], (curr_w, y, int(width - (curr_w - x)), height)
+        else:  # width <= height
+            curr_h = y
+            for i in range(last):
+                subheight = int(subtrees[i].data_size / total * height)
+                yield subtrees[i], (x, curr_h, width, subheight)
+                curr_h += subheight
+            yield subtrees[last], (x, curr_h, width,
+                                   int(height - (curr_h - y)))
 
     def round_up(self, number):
         """Round up the number.
@@ -238,6 +293,28 @@ class AbstractTree:
                 stored[0].data_size -= num
                 stored[0] = stored[0].get_parent()
 
+    def detach(self):
+        """Remove this tree from the subtrees of its parent, and subtract its
+        data_size from every tree above it. Afterwards, this tree has no
+        parent. Do nothing if it has none already.
+
+        @type self: AbstractTree
+        @rtype: None
+
+        >>> a1 = AbstractTree('f1', [], 10)
+        >>> a2 = AbstractTree('f2', [], 5)
+        >>> a3 = AbstractTree('F1', [a1, a2], 0)
+        >>> a1.detach()
+        >>> a3.data_size, a3.subtrees() == [a2], a1.get_parent()
+        (5, True, None)
+        """
+        parent = self._parent_tree
+        if parent is None:
+            return
+        self.update_datasize(self.data_size, 1)
+        parent.subtrees().remove(self)
+        self._parent_tree = None
+
     def get_separator(self):
         """Return the string used to separate nodes in the string
         representation of a path from the tree root to a leaf.
@@ -264,15 +341,66 @@ class FileSystemTree(AbstractTree):
     path. E.g., store 'assignments', not '/Users/David/csc148/assignments'
 
     The data_size attribute for regular files as simply the size of the file,
-    as reported by os.path.getsize.
+    as reported by os.path.getsize, or the space allocated to the file on
+    disk when the tree is built with disk_usage=True.
+
+    A folder that has already been scanned (identified by its device and
+    inode numbers) is never scanned twice, so symbolic links that point back
+    up the tree do not make the scan loop forever.
+
+    Folders that cannot be read are skipped instead of ending the scan, and
+    symbolic links that cannot be followed (dangling ones, or cycles of
+    links) are stored with the size of the link itself.
+
+    Files and folders can be pruned while scanning (see __init__); a pruned
+    folder is never opened, unless it is collapsed into a single leaf.
     """
-    def __init__(self, path):
+    def __init__(self, path, follow_symlinks=True, one_file_system=False,
+                 disk_usage=False, count_links_once=False, exclude=None,
+                 include=None, max_depth=None, min_size=0,
+                 collapse_pruned=False):
         """Store the file tree structure contained in the given file or folder.
 
+        If <follow_symlinks> is False, symbolic links are stored as files
+        (with the size of the link itself) instead of being followed.
+        If <one_file_system> is True, folders on a different file system than
+        <path> (i.e., mount points) are skipped.
+        If <disk_usage> is True, the size of a file is the space allocated to
+        it on disk (st_blocks) rather than its apparent size, like du. Unlike
+        du, the blocks of the folders themselves are not counted, since only
+        the leaves of a tree have a size of their own.
+        If <count_links_once> is True, a file with several hard links is only
+        stored the first time one of its links is found, like du.
+
+        The remaining options prune the tree while it is being scanned:
+        - Files and folders whose name, or path relative to <path>, matches
+          one of the glob patterns in <exclude> (e.g. '.git', 'node_modules',
+          '*.pyc') are skipped.
+        - If <include> is given, only the files matching one of its glob
+          patterns are stored. Folders are still scanned.
+        - Folders <max_depth> levels below <path> are not opened (the
+          entries of <path> are one level below it).
+        - Files and folders smaller than <min_size> are left out.
+        If <collapse_pruned> is True, a folder that is not opened because of
+        <max_depth> is stored as a single leaf holding the total size of its
+        contents, and the entries of a folder that are smaller than
+        <min_size> are combined into a single leaf named OTHER_NAME.
+        Otherwise, they are left out.
+
         Precondition: <path> is a valid path for this computer.
+        Precondition: <max_depth> is None or at least 1.
 
         @type self: FileSystemTree
         @type path: str
+        @type follow_symlinks: bool
+        @type one_file_system: bool
+        @type disk_usage: bool
+        @type count_links_once: bool
+        @type exclude: list[str] | None
+        @type include: list[str] | None
+        @type max_depth: int | None
+        @type min_size: int
+        @type collapse_pruned: bool
         @rtype: None
 
         >>> path1 = '/h/u10/c5/00/mengyifa/Desktop/csc148/assignments/a2/example/B/A/f1.txt'
@@ -302,17 +430,72 @@ class FileSystemTree(AbstractTree):
         >>> tree2.generate_treemap((0, 0, 200, 200))
         [((0, 0, 200, 50), ()), ((0, 50, 66, 150), ()), ((66, 50, 100, 150), ()), ((166, 50, 34, 150), ())]
         """
-        root = os.path.basename(path)
-        subtrees = []
-        if not os.path.isdir(path):  # when it is a regular file
-            data_size = os.path.getsize(path)
-            AbstractTree.__init__(self, root, subtrees, data_size)
-        else:  # when it is a folder
-            for filename in os.listdir(path):
-                subtree_path = os.path.join(path, filename)
-                f = FileSystemTree(subtree_path)
-                subtrees.append(f)
-            AbstractTree.__init__(self, root, subtrees, data_size=0)
+        scanner = _FileSystemScanner(type(self), path, follow_symlinks,
+                                     one_file_system, disk_usage,
+                                     count_links_once, exclude, include,
+                                     max_depth, min_size, collapse_pruned)
+        with instrumentation.phase('scan'):
+            self._scan(scanner, path)
+        instrumentation.count('stat_calls', scanner.stat_calls)
+        instrumentation.count('folders_listed', scanner.folders_listed)
+        instrumentation.count('folders_skipped', scanner.folders_skipped)
+
+    def _scan(self, scanner, path):
+        """Store the file tree structure at <path>, as scanned by <scanner>.
+
+        @type self: FileSystemTree
+        @type scanner: _FileSystemScanner
+        @type path: str
+        @rtype: None
+        """
+        info = scanner.stat_root(path)
+        if not stat.S_ISDIR(info.st_mode):  # when it is a regular file
+            AbstractTree.__init__(self, os.path.basename(path), [],
+                                  scanner.file_size(info))
+            return
+
+        # The folders are walked with an explicit stack rather than one
+        # recursive call per level, so arbitrarily deep hierarchies do not
+        # hit the recursion limit. Each stack entry is
+        # (tree, path, depth, subtrees): subtrees is None while the folder has
+        # not been listed yet, and holds the (already built) subtrees once the
+        # folder is ready to be initialized.
+        stack = [(self, path, 0, None)]
+        while len(stack) != 0:
+            tree, tree_path, depth, subtrees = stack.pop()
+            if subtrees is not None:  # all subtrees have been built
+                AbstractTree.__init__(tree, os.path.basename(tree_path),
+                                      scanner.prune_small(subtrees),
+                                      data_size=0)
+                self._folder_scanned(tree)
+                scanner.finish_folder(tree_path)
+            else:  # list the folder
+                subtrees, folders = scanner.list_folder(tree_path, depth)
+                stack.append((tree, tree_path, depth, subtrees))
+                # Push the folders in reverse so they are built in
+                # os.listdir order, before their parent is initialized.
+                stack.extend(reversed(folders))
+
+    def _folder_scanned(self, folder):
+        """Called by _scan once <folder>, a folder of this tree, and all its
+        subtrees have been built. Subclasses can override it, e.g. to move
+        finished folders out of memory; by default it does nothing.
+
+        @type self: FileSystemTree
+        @type folder: FileSystemTree
+        @rtype: None
+        """
+        pass
+
+    def rename(self, name):
+        """Change the name of this file or folder to <name>, e.g. after it
+        was moved.
+
+        @type self: FileSystemTree
+        @type name: str
+        @rtype: None
+        """
+        self._root = name
 
     def get_separator(self):
         """Return the string used to separate nodes in the string
@@ -323,6 +506,343 @@ class FileSystemTree(AbstractTree):
         """
         return "/"
 
+
+# The name of the leaf that collects the pruned entries of a folder.
+OTHER_NAME = '(other)'
+
+
+class _FileSystemScanner:
+    """The options and bookkeeping of a single FileSystemTree scan.
+
+    === Private Attributes ===
+    @type _tree_class: type
+        The FileSystemTree (sub)class of the trees being built.
+    @type _prefix_length: int
+        The length of the scanned path, including a trailing separator.
+    @type _follow_symlinks: bool
+        Whether symbolic links are followed.
+    @type _one_file_system: bool
+        Whether folders on other file systems are skipped.
+    @type _disk_usage: bool
+        Whether file sizes are the space allocated on disk.
+    @type _count_links_once: bool
+        Whether files with several hard links are only stored once.
+    @type _exclude: callable | None
+        Matches the names and relative paths to skip, if any.
+    @type _include: callable | None
+        Matches the names and relative paths of the files to store, if any.
+    @type _max_depth: int | None
+        The depth of the folders that are not opened, if any.
+    @type _min_size: int
+        The size below which files and folders are left out.
+    @type _collapse_pruned: bool
+        Whether pruned entries are collapsed into single leaves.
+    @type _device: int | None
+        The device of the scanned path, once it has been stat'ed.
+    @type _seen_folders: set[(int, int)]
+        The (device, inode) of the folders not to scan again: every folder
+        found so far, or only those still being scanned and those reached
+        through symbolic links if _open_folders is not None.
+    @type _open_folders: dict[str, (int, int)] | None
+        The (device, inode) of the folders still being scanned that were not
+        reached through symbolic links, by path, if finished folders are
+        forgotten; None otherwise.
+    @type _seen_files: dict[(int, int), int]
+        The (device, inode) of every hard linked file stored so far that has
+        links not found yet, with the number of those links.
+
+    === Public Attributes ===
+    @type stat_calls: int
+        The number of files and folders stat'ed so far.
+    @type folders_listed: int
+        The number of folders listed so far.
+    @type folders_skipped: int
+        The number of folders that could not be read so far.
+    """
+    def __init__(self, tree_class, path, follow_symlinks, one_file_system,
+                 disk_usage, count_links_once, exclude, include, max_depth,
+                 min_size, collapse_pruned):
+        """Initialize a new scanner of <path> with the given options.
+
+        See FileSystemTree.__init__ for the meaning of the options.
+
+        @type self: _FileSystemScanner
+        @type tree_class: type
+        @type path: str
+        @type follow_symlinks: bool
+        @type one_file_system: bool
+        @type disk_usage: bool
+        @type count_links_once: bool
+        @type exclude: list[str] | None
+        @type include: list[str] | None
+        @type max_depth: int | None
+        @type min_size: int
+        @type collapse_pruned: bool
+        @rtype: None
+        """
+        self._tree_class = tree_class
+        self._prefix_length = len(os.path.join(path, ''))
+        self._follow_symlinks = follow_symlinks
+        self._one_file_system = one_file_system
+        self._disk_usage = disk_usage
+        self._count_links_once = count_links_once
+        self._exclude = _compile_patterns(exclude)
+        self._include = _compile_patterns(include)
+        self._max_depth = max_depth
+        self._min_size = min_size
+        self._collapse_pruned = collapse_pruned
+        self._device = None
+        self._seen_folders = set()
+        self._open_folders = None
+        self._seen_files = {}
+        self.stat_calls = 0
+        self.folders_listed = 0
+        self.folders_skipped = 0
+
+    def stat_root(self, path):
+        """Return the stat result of the scanned <path> itself.
+
+        @type self: _FileSystemScanner
+        @type path: str
+        @rtype: os.stat_result
+        """
+        info = os.stat(path, follow_symlinks=self._follow_symlinks)
+        self.stat_calls += 1
+        self._device = info.st_dev
+        self._seen_folders.add((info.st_dev, info.st_ino))
+        return info
+
+    def forget_finished_folders(self):
+        """Only remember the folders still being scanned, and those reached
+        through symbolic links, instead of every folder found so far, so the
+        memory used does not grow with the number of folders.
+
+        Cycles are still skipped, as the folders of a cycle are still being
+        scanned when it is found again. But a folder reached through a
+        symbolic link after it was scanned directly (or mounted in several
+        places) is scanned again.
+
+        @type self: _FileSystemScanner
+        @rtype: None
+        """
+        self._open_folders = {}
+
+    def finish_folder(self, path):
+        """Record that the folder at <path> and all of its subtrees have been
+        scanned.
+
+        @type self: _FileSystemScanner
+        @type path: str
+        @rtype: None
+        """
+        if self._open_folders is not None:
+            key = self._open_folders.pop(path, None)
+            if key is not None:
+                self._seen_folders.discard(key)
+
+    def file_size(self, info):
+        """Return the data_size of a file with the given stat result.
+
+        @type self: _FileSystemScanner
+        @type info: os.stat_result
+        @rtype: int
+        """
+        if self._disk_usage:
+            return info.st_blocks * 512  # st_blocks is in 512-byte units
+        return info.st_size
+
+    def list_folder(self, path, depth):
+        """List the folder at <path>, which is <depth> levels below the
+        scanned path.
+
+        Return the subtrees of the folder in os.listdir order, and a list of
+        (subtree, path, depth, None) stack entries for the subfolders, which
+        still have to be scanned. The other subtrees are already initialized.
+
+        @type self: _FileSystemScanner
+        @type path: str
+        @type depth: int
+        @rtype: (list[FileSystemTree], list[(FileSystemTree, str, int, None)])
+        """
+        subtrees = []
+        folders = []
+        opened = self._max_depth is None or depth + 1 < self._max_depth
+        for entry, info, is_folder in self._entries(path):
+            subtree = self._tree_class.__new__(self._tree_class)
+            if not is_folder:
+                AbstractTree.__init__(subtree, entry.name, [],
+                                      self.file_size(info))
+            elif opened:
+                folders.append((subtree, entry.path, depth + 1, None))
+            elif self._collapse_pruned:  # a single leaf for the whole folder
+                AbstractTree.__init__(subtree, entry.name, [],
+                                      self._folder_size(entry.path))
+            else:  # the folder is pruned by max_depth
+                self.finish_folder(entry.path)
+                continue
+            subtrees.append(subtree)
+        return subtrees, folders
+
+    def prune_small(self, subtrees):
+        """Return <subtrees> without the subtrees smaller than the minimum
+        size. If pruned entries are collapsed, they are replaced by a single
+        leaf at the end.
+
+        @type self: _FileSystemScanner
+        @type subtrees: list[FileSystemTree]
+        @rtype: list[FileSystemTree]
+        """
+        if self._min_size == 0:
+            return subtrees
+        kept = []
+        other_size = 0
+        for subtree in subtrees:
+            if subtree.data_size < self._min_size:
+                other_size += subtree.data_size
+            else:
+                kept.append(subtree)
+        if self._collapse_pruned and other_size > 0:
+            other = self._tree_class.__new__(self._tree_class)
+            AbstractTree.__init__(other, OTHER_NAME, [], other_size)
+            kept.append(other)
+        return kept
+
+    def _entries(self, path):
+        """Yield (entry, stat result, is folder) for each entry of the folder
+        at <path> that is kept by the scan options, in os.listdir order.
+
+        A folder that cannot be read is skipped (and counted) rather than
+        ending the scan, and symbolic links that cannot be followed (dangling
+        ones, or cycles of links) are stored as links.
+
+        @type self: _FileSystemScanner
+        @type path: str
+        @rtype: generator
+        """
+        follow_symlinks = self._follow_symlinks
+        try:
+            entries = os.scandir(path)
+        except OSError:  # unreadable, or gone
+            self.folders_skipped += 1
+            return
+        self.folders_listed += 1
+        with entries:
+            for entry in entries:
+                if self._matches(self._exclude, entry):
+                    continue
+                self.stat_calls += 1
+                try:
+                    info = entry.stat(follow_symlinks=follow_symlinks)
+                except OSError:  # a dangling link, or a cycle of links
+                    try:
+                        info = entry.stat(follow_symlinks=False)
+                    except OSError:  # deleted since it was listed
+                        continue
+                if stat.S_ISDIR(info.st_mode):
+                    if self._is_new_folder(entry, info):
+                        yield entry, info, True
+                elif self._include is None or \
+                        self._matches(self._include, entry):
+                    if self._is_new_file(info):
+                        yield entry, info, False
+
+    def _folder_size(self, path):
+        """Return the total size of the files kept by the scan options in the
+        folder at <path>, without building any subtrees.
+
+        @type self: _FileSystemScanner
+        @type path: str
+        @rtype: int
+        """
+        total = 0
+        # Each stack entry is (path, listed), where listed tells whether the
+        # folder has been listed already, and only has to be finished.
+        stack = [(path, False)]
+        while len(stack) != 0:
+            folder_path, listed = stack.pop()
+            if listed:
+                self.finish_folder(folder_path)
+                continue
+            stack.append((folder_path, True))
+            for entry, info, is_folder in self._entries(folder_path):
+                if is_folder:
+                    stack.append((entry.path, False))
+                else:
+                    total += self.file_size(info)
+        return total
+
+    def _matches(self, patterns, entry):
+        """Return whether the name or the relative path of <entry> matches
+        <patterns>.
+
+        @type self: _FileSystemScanner
+        @type patterns: callable | None
+        @type entry: os.DirEntry
+        @rtype: bool
+        """
+        if patterns is None:
+            return False
+        return patterns(entry.name) is not None or \
+            patterns(entry.path[self._prefix_length:]) is not None
+
+    def _is_new_folder(self, entry, info):
+        """Return whether the folder <entry>, with stat result <info>, should
+        be scanned, and record it as seen if so.
+
+        @type self: _FileSystemScanner
+        @type entry: os.DirEntry
+        @type info: os.stat_result
+        @rtype: bool
+        """
+        if self._one_file_system and info.st_dev != self._device:
+            return False
+        key = (info.st_dev, info.st_ino)
+        if key in self._seen_folders:  # a symlink loop or a repeated mount
+            return False
+        self._seen_folders.add(key)
+        if self._open_folders is not None and not entry.is_symlink():
+            self._open_folders[entry.path] = key
+        return True
+
+    def _is_new_file(self, info):
+        """Return whether the file with stat result <info> should be stored,
+        and record it as seen if so.
+
+        @type self: _FileSystemScanner
+        @type info: os.stat_result
+        @rtype: bool
+        """
+        if not self._count_links_once or info.st_nlink <= 1:
+            return True
+        key = (info.st_dev, info.st_ino)
+        links = self._seen_files.pop(key, None)
+        if links is None:
+            self._seen_files[key] = info.st_nlink - 1
+            return True
+        # Another link to a stored file; forget the file after its last one.
+        if links > 1:
+            self._seen_files[key] = links - 1
+        return False
+
+
+def _compile_patterns(patterns):
+    """Return the match function of a regular expression that matches any of
+    the glob <patterns>, or None if there are no patterns.
+
+    @type patterns: list[str] | None
+    @rtype: callable | None
+
+    >>> match = _compile_patterns(['*.pyc', '.git'])
+    >>> match('a.pyc') is not None
+    True
+    >>> match('.gitignore') is None
+    True
+    """
+    if not patterns:
+        return None
+    return re.compile('|'.join(fnmatch.translate(p) for p in patterns)).match
+
+
 if __name__ == '__main__':
     import python_ta
     # Remember to change this to check_all when cleaning up your code.
@@ -0,0 +1,226 @@
+"""Treemap Growth Diffs
+
+=== Module Description ===
+This module compares two scans of the same root, e.g. to find out what
+filled a disk overnight. The scans can be AbstractTrees or snapshot files
+(see snapshot.py).
+
+The result is a growth tree: a SnapshotTree with the same paths as the newer
+scan, whose leaves are the leaves that grew (or are new) with data_size set
+to how much they grew. Leaves and folders that did not grow are left out, so
+the growth tree can be passed to the treemap visualiser as it is. To see
+what shrank, diff the scans in the opposite order.
+
+Both scans are read as streams of snapshot records, which list the subtrees
+of every node sorted by name. Matching nodes are found by walking the two
+streams side by side, so every node is read exactly once, and only the
+growth tree and the current path are held in memory (besides the scans
+themselves, when they are trees rather than files).
+"""
+from snapshot import FOLDER, SnapshotTree, read_snapshot, tree_records
+
+
+def diff_trees(old, new):
+    """Return the growth tree from the <old> scan to the <new> scan.
+
+    Each scan is either an AbstractTree or the path of a snapshot file.
+    The roots of the scans are always matched with each other, whatever
+    their names. A file that replaced a folder (or the other way around)
+    counts as new.
+
+    @type old: AbstractTree | str
+    @type new: AbstractTree | str
+    @rtype: SnapshotTree
+
+    >>> old = SnapshotTree('B', [SnapshotTree('f1', [], 10),
+    ...                          SnapshotTree('f2', [], 10)])
+    >>> new = SnapshotTree('B', [SnapshotTree('f1', [], 10),
+    ...                          SnapshotTree('f2', [], 15),
+    ...                          SnapshotTree('f3', [], 5)])
+    >>> growth = diff_trees(old, new)
+    >>> growth.data_size
+    10
+    >>> [(t.treename(), t.data_size) for t in growth.subtrees()]
+    [('f2', 5), ('f3', 5)]
+    """
+    _, old_records = _records(old)
+    separator, new_records = _records(new)
+    old_stream = _Stream(old_records)
+    new_stream = _Stream(new_records)
+
+    old_root = old_stream.next()
+    new_root = new_stream.next()
+    if new_root[2] != FOLDER:  # the new scan is a single file
+        if old_root[2] == FOLDER:
+            old_root = None
+        return SnapshotTree(new_root[3], [], _growth(old_root, new_root),
+                            separator)
+
+    return _diff_folders(old_stream, new_stream, new_root[3], separator)
+
+
+def _diff_folders(old_stream, new_stream, name, separator):
+    """Return the growth tree of the folder <name>, the root of the new scan,
+    whose root records were just read from <old_stream> and <new_stream>.
+
+    @type old_stream: _Stream
+    @type new_stream: _Stream
+    @type name: str
+    @type separator: str
+    @rtype: SnapshotTree
+    """
+    # Each frame is (name, depth, subtrees) for a folder of the new scan
+    # whose subtrees are being compared; subtrees holds the growth subtrees
+    # found so far. The next old record is a subtree of the same folder of
+    # the old scan, if there is one.
+    frames = [(name, 0, [])]
+    while True:
+        _, depth, subtrees = frames[-1]
+        old_next = old_stream.peek()
+        new_next = new_stream.peek()
+        old_child = old_next is not None and old_next[0] == depth + 1
+        new_child = new_next is not None and new_next[0] == depth + 1
+
+        if not new_child:  # the folder is done
+            if old_child:  # whatever is left of the old folder was deleted
+                old_stream.skip_subtree(depth)
+            root = _close_folder(frames, separator)
+            if root is not None:
+                return root
+        elif old_child and old_next[3] < new_next[3]:  # deleted from new
+            old_stream.next()
+            old_stream.skip_subtree(depth + 1)
+        elif new_next[2] == FOLDER:
+            new_record = new_stream.next()
+            _read_match(old_stream, new_record)
+            frames.append((new_record[3], depth + 1, []))
+        else:
+            new_record = new_stream.next()
+            growth = _growth(_read_match(old_stream, new_record), new_record)
+            if growth > 0:
+                subtrees.append(SnapshotTree(new_record[3], [], growth,
+                                             separator))
+
+
+def _close_folder(frames, separator):
+    """Pop the top frame of <frames>, and add its growth tree to the frame
+    below it if it grew. Return the growth tree if it was the root, or None
+    otherwise.
+
+    @type frames: list[(str, int, list[SnapshotTree])]
+    @type separator: str
+    @rtype: SnapshotTree | None
+    """
+    name, _, subtrees = frames.pop()
+    if len(frames) == 0:
+        return SnapshotTree(name, subtrees, 0, separator)
+    if len(subtrees) != 0:
+        frames[-1][2].append(SnapshotTree(name, subtrees, 0, separator))
+    return None
+
+
+def _read_match(old_stream, new_record):
+    """Read and return the next record of <old_stream> if it matches
+    <new_record>, which was just read from the new scan, or return None if
+    <new_record> has no match.
+
+    A match has the same depth, name and kind. An old record with the same
+    name but another kind (a file that became a folder, or the other way
+    around) is skipped with its subtree.
+
+    @type old_stream: _Stream
+    @type new_record: (int, int, str, str)
+    @rtype: (int, int, str, str) | None
+    """
+    old_next = old_stream.peek()
+    if old_next is None or old_next[0] != new_record[0] or \
+            old_next[3] != new_record[3]:
+        return None
+    old_record = old_stream.next()
+    if old_record[2] != new_record[2]:
+        old_stream.skip_subtree(new_record[0])
+        return None
+    return old_record
+
+
+class _Stream:
+    """A stream of snapshot records that can be peeked at.
+
+    === Private Attributes ===
+    @type _records: iterator[(int, int, str, str)]
+        The records that have not been read yet.
+    @type _next: (int, int, str, str) | None
+        The next record, or None if there are no more records.
+    """
+    def __init__(self, records):
+        """Initialize a new stream of <records>.
+
+        @type self: _Stream
+        @type records: iterable[(int, int, str, str)]
+        @rtype: None
+        """
+        self._records = iter(records)
+        self._next = next(self._records, None)
+
+    def peek(self):
+        """Return the next record without reading it, or None if there are no
+        more records.
+
+        @type self: _Stream
+        @rtype: (int, int, str, str) | None
+        """
+        return self._next
+
+    def next(self):
+        """Read and return the next record.
+
+        Precondition: there are more records.
+
+        @type self: _Stream
+        @rtype: (int, int, str, str)
+        """
+        record = self._next
+        self._next = next(self._records, None)
+        return record
+
+    def skip_subtree(self, depth):
+        """Skip the records deeper than <depth>, i.e. the rest of the subtree
+        of the last record read at <depth>.
+
+        @type self: _Stream
+        @type depth: int
+        @rtype: None
+        """
+        while self._next is not None and self._next[0] > depth:
+            self._next = next(self._records, None)
+
+
+def _records(scan):
+    """Return the separator and the snapshot records of <scan>.
+
+    @type scan: AbstractTree | str
+    @rtype: (str, iterator[(int, int, str, str)])
+    """
+    if isinstance(scan, str):
+        header, records = read_snapshot(scan)
+        return header['separator'], records
+    return scan.get_separator(), tree_records(scan)
+
+
+def _growth(old_record, new_record):
+    """Return how much a leaf grew from <old_record> (None if it is new) to
+    <new_record>, or 0 if it did not grow.
+
+    @type old_record: (int, int, str, str) | None
+    @type new_record: (int, int, str, str)
+    @rtype: int
+    """
+    if old_record is None:
+        return new_record[1]
+    return max(0, new_record[1] - old_record[1])
+
+
+if __name__ == '__main__':
+    import python_ta
+    # Remember to change this to check_all when cleaning up your code.
+    python_ta.check_errors(config='pylintrc.txt')
@@ -11,13 +11,28 @@ It is responsible for initializing an instance of AbstractTree (using a
 concrete subclass, of course), rendering it to the user using pygame,
 and detecting user events like mouse clicks and key presses and responding
 to them.
+
+Every run_treemap_* function takes an <instrument> flag. When it is True,
+the instrumentation module is enabled before the tree is built, so that the
+scan (or import) is timed too, and the performance HUD is shown from the
+start.
 """
+import time
+
 import pygame
+import instrumentation
+from layout import TreemapView
 from tree_data import FileSystemTree
 from population import PopulationTree
+from shard import merge_shards
+from spill import SpillingFileSystemTree
+from tree_diff import diff_trees
+from tree_builder import import_du, import_json, import_listing
+from watcher import TreeWatcher
 
 
-# Screen dimensions and coordinates
+# Screen dimensions and coordinates. The window can be resized; these are its
+# initial dimensions.
 ORIGIN = (0, 0)
 WIDTH = 1024
 HEIGHT = 768
@@ -27,55 +42,113 @@ TREEMAP_HEIGHT = HEIGHT - FONT_HEIGHT  # The height of the treemap display.
 # Font to use for the treemap program.
 FONT_FAMILY = 'Consolas'
 
+# The height of one line of the performance HUD, and its background colour.
+HUD_FONT_HEIGHT = 16
+HUD_BACKGROUND = (0, 0, 0, 180)
+
+# The time between two batches of file system changes in watch mode, in
+# seconds.
+WATCH_INTERVAL = 1 / 30
+
+# The stubs of a SpillingFileSystemTree drawn at least this many pixels wide
+# and high are loaded from disk, so that their contents are shown.
+EXPAND_PIXELS = 64
 
-def run_visualisation(tree):
+
+def run_visualisation(tree, watcher=None, hud=False):
     """Display an interactive graphical display of the given tree's treemap.
 
+    If a <watcher> is given, the changes it reports are applied to the tree
+    and the display while it is open. If <hud> is True, the performance HUD
+    is shown from the start.
+
     @type tree: AbstractTree
+    @type watcher: TreeWatcher | None
+    @type hud: bool
     @rtype: None
     """
     # Setup pygame
     pygame.init()
-    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.RESIZABLE)
 
     # Render the initial display of the static treemap.
-    render_display(screen, tree, '')
+    view = TreemapView(tree)
+    render_display(screen, tree, '', hud, view)
 
     # Start an event loop to respond to events.
-    event_loop(screen, tree)
+    event_loop(screen, tree, view, watcher, hud)
 
 
-def render_display(screen, tree, text):
+def render_display(screen, tree, text, hud=False, view=None):
     """Render a treemap and text display to the given screen.
 
-    Use the constants TREEMAP_HEIGHT and FONT_HEIGHT to divide the
-    screen vertically into the treemap and text comments.
+    Use the constant FONT_HEIGHT to divide the screen vertically into the
+    treemap and text comments; the treemap takes the rest of the screen.
+
+    The treemap is drawn from the cached layout in <view>, if one is given.
+    The stubs of a SpillingFileSystemTree that would be drawn at least
+    EXPAND_PIXELS wide and high are expanded first.
+
+    If <hud> is True, the performance metrics collected by the instrumentation
+    module are drawn over the top left corner of the treemap.
 
     @type screen: pygame.Surface
     @type tree: AbstractTree
     @type text: str
         The text to render.
+    @type hud: bool
+    @type view: TreemapView | None
     @rtype: None
     """
+    start = time.perf_counter()
+    width, height = screen.get_size()
+    treemap_height = height - FONT_HEIGHT
+    if view is None:
+        view = TreemapView(tree)
+
     # First, clear the screen
     pygame.draw.rect(screen, pygame.color.THECOLORS['black'],
-                     (0, 0, WIDTH, HEIGHT))
+                     (0, 0, width, height))
 
     # The treemap display
-    treemap = tree.generate_treemap((0, 0, WIDTH, TREEMAP_HEIGHT))
-    if len(treemap) == 0:  # B.C: if the tree is empty
-        pygame.draw.rect(screen, pygame.color.THECOLORS['black'], (0, 0, WIDTH, TREEMAP_HEIGHT))
-    else:
-        for t in treemap:
-            rec, col = t  # extract coordinates of a rectangle and its color
-            pygame.draw.rect(screen, col, rec)
+    treemap = view.rects(width, treemap_height)
+    if isinstance(tree, SpillingFileSystemTree):
+        while _expand_large_stubs(view):
+            view.invalidate()
+            treemap = view.rects(width, treemap_height)
+    with instrumentation.phase('draw'):
+        if len(treemap) == 0:  # B.C: if the tree is empty
+            pygame.draw.rect(screen, pygame.color.THECOLORS['black'], (0, 0, width, treemap_height))
+        else:
+            for t in treemap:
+                rec, col = t  # extract coordinates of a rectangle and its color
+                pygame.draw.rect(screen, col, rec)
+    instrumentation.count('rects_drawn', len(treemap))
 
     # The text display
-    pygame.draw.rect(screen, pygame.color.THECOLORS['black'], (0, TREEMAP_HEIGHT, WIDTH, FONT_HEIGHT))
+    pygame.draw.rect(screen, pygame.color.THECOLORS['black'], (0, treemap_height, width, FONT_HEIGHT))
     _render_text(screen, text)
+    if hud:
+        _render_hud(screen)
 
     # This must be called *after* all other pygame functions have run.
-    pygame.display.flip()
+    with instrumentation.phase('flip'):
+        pygame.display.flip()
+    instrumentation.end_frame(time.perf_counter() - start)
+
+
+def _expand_large_stubs(view):
+    """Expand the stubs drawn at least EXPAND_PIXELS wide and high in
+    <view>. Return whether there were any.
+
+    @type view: TreemapView
+    @rtype: bool
+    """
+    stubs = [leaf for leaf in view.large_leaves(EXPAND_PIXELS)
+             if leaf.is_stub()]
+    for stub in stubs:
+        stub.expand()
+    return len(stubs) != 0
 
 
 def _render_text(screen, text):
@@ -90,11 +163,34 @@ def _render_text(screen, text):
     text_surface = font.render(text, 1, pygame.color.THECOLORS['white'])
 
     # Where to render the text_surface
-    text_pos = (0, HEIGHT - FONT_HEIGHT + 4)
+    text_pos = (0, screen.get_height() - FONT_HEIGHT + 4)
     screen.blit(text_surface, text_pos)
 
 
-def event_loop(screen, tree):
+def _render_hud(screen):
+    """Render the latest performance metrics over the top left corner of the
+    treemap.
+
+    The metrics are those of the previous frame, since the current one is not
+    finished yet.
+
+    @type screen: pygame.Surface
+    @rtype: None
+    """
+    font = pygame.font.SysFont(FONT_FAMILY, HUD_FONT_HEIGHT)
+    lines = instrumentation.summary_lines()
+    surfaces = [font.render(line, 1, pygame.color.THECOLORS['white'])
+                for line in lines]
+    width = max(surface.get_width() for surface in surfaces) + 8
+    background = pygame.Surface((width, len(lines) * HUD_FONT_HEIGHT + 8),
+                                pygame.SRCALPHA)
+    background.fill(HUD_BACKGROUND)
+    screen.blit(background, (0, 0))
+    for i in range(len(surfaces)):
+        screen.blit(surfaces[i], (4, 4 + i * HUD_FONT_HEIGHT))
+
+
+def event_loop(screen, tree, view=None, watcher=None, hud=False):
     """Respond to events (mouse clicks, key presses) and update the display.
 
     Note that the event loop is an *infinite loop*: it continually waits for
@@ -102,30 +198,69 @@ def event_loop(screen, tree):
     of the visualisation or the tree itself, updating the display if necessary.
     This loop ends when the user closes the window.
 
+    Pressing H turns the performance HUD (and the instrumentation behind it)
+    on and off; <hud> is whether it is shown at first. Clicking a stub of a
+    SpillingFileSystemTree that is too small to be expanded when it is drawn
+    loads its subtrees from disk and draws them. When the window is resized,
+    the cached layout in <view> is scaled to the new size; it is only
+    computed again when the tree changes.
+
+    If a <watcher> is given, the file system changes it has seen are applied
+    to the tree every WATCH_INTERVAL seconds, all at once, followed by a
+    single redraw.
+
     @type screen: pygame.Surface
     @type tree: AbstractTree
+    @type view: TreemapView | None
+    @type watcher: TreeWatcher | None
+    @type hud: bool
     @rtype: None
     """
+    if view is None:
+        view = TreemapView(tree)
     clicked = False  # to store the clicked times
     selected = None  # to store the selected leaf
     text = ''  # to initiate the text
+    textline = ''  # the text currently displayed
+    next_watch = 0  # when to apply the next batch of file system changes
     while True:
+        if watcher is not None and time.perf_counter() >= next_watch:
+            next_watch = time.perf_counter() + WATCH_INTERVAL
+            if watcher.update():
+                if clicked and not watcher.contains(selected):
+                    clicked = False
+                    textline = ''
+                view.invalidate()
+                render_display(screen, tree, textline, hud, view)
+
         # Wait for an event
         event = pygame.event.poll()
         if event.type == pygame.QUIT:
             return
-        if event.type == pygame.MOUSEBUTTONUP:
+        if event.type == pygame.VIDEORESIZE:
+            # Only the latest size matters while the window is being dragged.
+            for resize in pygame.event.get(pygame.VIDEORESIZE):
+                event = resize
+            screen = pygame.display.set_mode(event.size, pygame.RESIZABLE)
+            render_display(screen, tree, textline, hud, view)
+        elif event.type == pygame.MOUSEBUTTONUP:
             x, y = event.pos
             txt = tree.treename()
-            selected_leaf, text = selected_leaf_and_its_path(tree, x, y, txt)
+            selected_leaf, text = selected_leaf_and_its_path(tree, x, y, txt,
+                                                             view)
             if event.button == 1:
                 if selected_leaf is None:
                     pass
+                elif isinstance(selected_leaf, SpillingFileSystemTree) and \
+                        selected_leaf.is_stub():
+                    selected_leaf.expand()
+                    view.invalidate()
+                    render_display(screen, tree, textline, hud, view)
                 elif clicked is False:
                     selected = selected_leaf
                     clicked = True
                     textline = text + " ({})".format(selected_leaf.data_size)
-                    render_display(screen, tree, textline)
+                    render_display(screen, tree, textline, hud, view)
                 elif clicked is True:
                     if selected == selected_leaf:
                         clicked = False
@@ -133,12 +268,19 @@ def event_loop(screen, tree):
                     else:
                         selected = selected_leaf
                         textline = text + " ({})".format(selected_leaf.data_size)
-                    render_display(screen, tree, textline)
+                    render_display(screen, tree, textline, hud, view)
             elif event.button == 3:
-                selected_leaf.update_datasize(selected_leaf.data_size, 1)
-                selected_leaf.data_size = 0
-                selected_leaf.get_parent().subtrees().remove(selected_leaf)
-                render_display(screen, tree, '')
+                _delete_leaf(selected_leaf, watcher)
+                view.invalidate()
+                textline = ''
+                render_display(screen, tree, textline, hud, view)
+        elif event.type == pygame.KEYUP and event.key == pygame.K_h:
+            hud = not hud
+            if hud:
+                instrumentation.enable()
+            else:
+                instrumentation.disable()
+            render_display(screen, tree, textline, hud, view)
         elif event.type == pygame.KEYUP:
             if clicked is True:
                 n = 0.01 * selected.data_size
@@ -151,27 +293,57 @@ def event_loop(screen, tree):
                     if selected.data_size <= 1:
                         selected.data_size = 1
                     selected.update_datasize(round_n, 1)
+                view.invalidate()
                 textline = text + " ({})".format(selected.data_size)
-                render_display(screen, tree, textline)
+                render_display(screen, tree, textline, hud, view)
 
 
-def selected_leaf_and_its_path(tree, x, y, txt):
+def _delete_leaf(leaf, watcher=None):
+    """Remove <leaf> from its tree, through <watcher> if the tree is watched,
+    so that the changes made on disk to it later are not applied.
+
+    @type leaf: AbstractTree
+    @type watcher: TreeWatcher | None
+    @rtype: None
+    """
+    if watcher is not None:
+        watcher.remove(leaf)
+    else:
+        leaf.detach()
+    leaf.data_size = 0
+
+
+def selected_leaf_and_its_path(tree, x, y, txt, view=None):
     """Return the selected leaf and its path string according to different tree attributes.
 
+    If <view> is given, the leaf is looked up in the treemap it last drew;
+    otherwise, in a treemap of the initial window size.
+
     @type tree: AbstractTree
     @type x: int
     @type y: int
     @type txt: object
+    @type view: TreemapView | None
     @rtype: (AbstractTree, str)
     """
     selected = None
     text = txt
+    if view is None:
+        width, treemap_height = WIDTH, TREEMAP_HEIGHT
+    else:
+        width, treemap_height = view.size
     if tree.data_size == 0:  # if the tree has 0 data size, do nothing
         pass
-    elif 0 <= x <= WIDTH and TREEMAP_HEIGHT < y <= HEIGHT:  # if the text display is selected
+    elif 0 <= x <= width and treemap_height < y:  # if the text display is selected
         text = ''
     elif len(tree.subtrees()) == 0:
         selected = tree
+    elif view is not None:  # look the leaf up in the drawn treemap
+        path = view.leaf_at(x, y)
+        if path is not None:
+            selected = path[-1]
+            for subtree in path[1:]:
+                text += subtree.get_separator() + subtree.treename()
     elif len(tree.subtrees()) != 0:  # if the tree has subtrees, call the helper function
         treemap = (0, 0, WIDTH, TREEMAP_HEIGHT)
         selected, text = rect_to_leaf(tree, treemap, x, y, txt)
@@ -189,65 +361,153 @@ def rect_to_leaf(tree, treemap, x, y, txt):
     @rtype: (AbstractTree, str)
     """
     text = txt
-    ori_x, ori_y, width, height = treemap
-    curr_w = ori_x
-    curr_h = ori_y
-    sub_curr = 0  # set to use for the last rectangle
-    for i in range(0, len(tree.subtrees())):  # recomputing the rectangles
-        proportion = tree.subtrees()[i].data_size / tree.data_size
-        if width > height:
-            if i != len(tree.subtrees()) - 1:  # if it is not the last rectangle
-                subwidth = int(proportion * width)
-                sub_curr += subwidth
-            else:  # if it is the last rectangle
-                subwidth = int(width - sub_curr)
-            subtreemap = (curr_w, ori_y, subwidth, height)
-            rect_x, rect_y = tree.get_coordinates(subtreemap)
-            if (rect_x[0] <= x < rect_x[1]) and (rect_y[0] <= y < rect_y[1]):  # locate the mouse cursor
-                selected_leaf = tree.subtrees()[i]
-                text += selected_leaf.get_separator() + selected_leaf.treename()
-                if len(selected_leaf.subtrees()) != 0:
-                    return rect_to_leaf(selected_leaf, subtreemap, x, y, text)
-                else:  # if it is a leaf
-                    return selected_leaf, text
-            curr_w += subwidth
-        elif width <= height:
-            if i != len(tree.subtrees()) - 1:  # if it is not the last rectangle
-                subheight = int(proportion * height)
-                sub_curr += subheight
-            else:  # if it is the last rectangle
-                subheight = int(height - sub_curr)
-            subtreemap = (ori_x, curr_h, width, subheight)
-            rect_x, rect_y = tree.get_coordinates(subtreemap)
-            if (rect_x[0] <= x < rect_x[1]) and (rect_y[0] <= y < rect_y[1]):  # locate the mouse cursor
-                selected_leaf = tree.subtrees()[i]
-                text += selected_leaf.get_separator() + selected_leaf.treename()
-                if len(selected_leaf.subtrees()) != 0:
-                    return rect_to_leaf(selected_leaf, subtreemap, x, y, text)
-                else:  # if it is a leaf
-                    return selected_leaf, text
-            curr_h += subheight
-
-
-def run_treemap_file_system(path):
+    levels = 0
+    # Walk down one level at a time instead of recursing, so very deep trees
+    # do not hit the recursion limit. The rectangles of each level are
+    # computed lazily, up to the one under the cursor.
+    with instrumentation.phase('rect_to_leaf'):
+        while True:
+            levels += 1
+            for subtree, subtreemap in tree.iter_subtree_rects(treemap):
+                rect_x, rect_y, width, height = subtreemap
+                if rect_x <= x < rect_x + width and rect_y <= y < rect_y + height:  # locate the mouse cursor
+                    text += subtree.get_separator() + subtree.treename()
+                    break
+            else:  # the cursor is not in any of the rectangles
+                subtree = None
+                break
+            if len(subtree.subtrees()) == 0:  # if it is a leaf
+                break
+            tree, treemap = subtree, subtreemap
+    instrumentation.count('hit_test_levels', levels)
+    if subtree is None:
+        return None
+    return subtree, text
+
+
+def run_treemap_file_system(path, instrument=False):
     """Run a treemap visualisation for the given path's file structure.
 
     Precondition: <path> is a valid path to a file or folder.
 
     @type path: str
+    @type instrument: bool
+    @rtype: None
+    """
+    if instrument:
+        instrumentation.enable()
+    file_tree = FileSystemTree(path)
+    run_visualisation(file_tree, hud=instrument)
+
+
+def run_treemap_watch(path, instrument=False):
+    """Run a treemap visualisation of the folder <path> that follows the
+    changes made to it while it is open; see watcher.py.
+
+    Precondition: <path> is a valid path to a folder.
+
+    @type path: str
+    @type instrument: bool
     @rtype: None
     """
+    if instrument:
+        instrumentation.enable()
     file_tree = FileSystemTree(path)
-    run_visualisation(file_tree)
+    watcher = TreeWatcher(file_tree, path)
+    try:
+        run_visualisation(file_tree, watcher, instrument)
+    finally:
+        watcher.close()
+
+
+def run_treemap_spilling(path, max_resident_nodes, instrument=False):
+    """Run a treemap visualisation for the given path's file structure,
+    keeping at most about <max_resident_nodes> nodes in memory while it is
+    scanned; see spill.py. The folders moved to disk are loaded back when
+    they are drawn at least EXPAND_PIXELS wide and high, or clicked.
+
+    Precondition: <path> is a valid path to a file or folder.
+
+    @type path: str
+    @type max_resident_nodes: int
+    @type instrument: bool
+    @rtype: None
+    """
+    if instrument:
+        instrumentation.enable()
+    file_tree = SpillingFileSystemTree(path, max_resident_nodes)
+    try:
+        run_visualisation(file_tree, hud=instrument)
+    finally:
+        file_tree.close()
+
+
+def run_treemap_shards(root, shard_paths, instrument=False):
+    """Run a treemap visualisation of the folder <root>, from shard files
+    scanned separately; see shard.merge_shards.
+
+    @type root: str
+    @type shard_paths: list[str]
+    @type instrument: bool
+    @rtype: None
+    """
+    if instrument:
+        instrumentation.enable()
+    merged_tree = merge_shards(root, shard_paths)
+    run_visualisation(merged_tree, hud=instrument)
+
+
+def run_treemap_growth(old, new, instrument=False):
+    """Run a treemap visualisation of what grew between two scans.
+
+    Each scan is an AbstractTree or the path of a snapshot file; see
+    tree_diff.diff_trees.
+
+    @type old: AbstractTree | str
+    @type new: AbstractTree | str
+    @type instrument: bool
+    @rtype: None
+    """
+    if instrument:
+        instrumentation.enable()
+    growth_tree = diff_trees(old, new)
+    run_visualisation(growth_tree, hud=instrument)
+
+
+def run_treemap_import(path, instrument=False):
+    """Run a treemap visualisation of the tree described in the file <path>.
+
+    Files ending in .json are read as nested JSON, .csv and .tsv files as
+    listings of paths and sizes, and any other file as the output of `du -ab`;
+    see tree_builder.py.
+
+    @type path: str
+    @type instrument: bool
+    @rtype: None
+    """
+    if instrument:
+        instrumentation.enable()
+    if path.endswith('.json'):
+        imported_tree = import_json(path)
+    elif path.endswith('.csv'):
+        imported_tree = import_listing(path, ',')
+    elif path.endswith('.tsv'):
+        imported_tree = import_listing(path, '\t')
+    else:
+        imported_tree = import_du(path)
+    run_visualisation(imported_tree, hud=instrument)
 
 
-def run_treemap_population():
+def run_treemap_population(instrument=False):
     """Run a treemap visualisation for World Bank population data.
 
+    @type instrument: bool
     @rtype: None
     """
+    if instrument:
+        instrumentation.enable()
     pop_tree = PopulationTree(True)
-    run_visualisation(pop_tree)
+    run_visualisation(pop_tree, hud=instrument)
 
 
 if __name__ == '__main__':
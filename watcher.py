@@ -0,0 +1,421 @@
+"""Live File System Updates
+
+=== Module Description ===
+This module keeps a FileSystemTree up to date while the folder it was
+scanned from changes, using the Linux inotify API through ctypes.
+
+Every folder of the tree is watched. The events are read without blocking
+and applied in batches, one batch per frame of the visualiser, directly to
+the tree; nothing is scanned again:
+
+- A deleted file or folder is removed from its parent, and its size is
+  subtracted from every folder above it.
+- A created file is added as a new leaf. A created folder, or one moved in
+  from outside the tree, is scanned on its own and spliced in.
+- A file or folder moved within the tree is detached from its old parent
+  and spliced under its new one, with its subtrees unchanged.
+- A modified file is stat'ed again, once per batch however many times it
+  was written to or renamed, and the difference in size is propagated up
+  the tree.
+
+The options that prune a scan (see FileSystemTree.__init__) cannot be kept
+up to date this way, so trees scanned with them cannot be watched.
+
+If the kernel's event queue overflows, some changes are lost; the overflowed
+attribute of the watcher records it.
+"""
+import ctypes
+import ctypes.util
+import os
+import struct
+from random import randint
+
+import instrumentation
+from tree_data import AbstractTree, FileSystemTree
+
+try:
+    _LIBC = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _LIBC.inotify_init1.argtypes = [ctypes.c_int]
+    _LIBC.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                        ctypes.c_uint32]
+    _LIBC.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+except (OSError, AttributeError):  # inotify is only available on Linux
+    _LIBC = None
+
+
+# inotify event flags; see inotify(7).
+IN_MODIFY = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# The events every folder is watched for.
+WATCH_MASK = (IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_ONLYDIR | IN_EXCL_UNLINK)
+
+# The header of an inotify event: wd, mask, cookie and the length of the name.
+_EVENT = struct.Struct('iIII')
+
+# The number of bytes read from the inotify file descriptor at a time.
+READ_SIZE = 64 * 1024
+
+# The FileSystemTree options a watched tree cannot have been scanned with.
+PRUNING_OPTIONS = ('count_links_once', 'exclude', 'include', 'max_depth',
+                   'min_size', 'collapse_pruned')
+
+
+class TreeWatcher:
+    """Applies the changes to a folder to the FileSystemTree scanned from it.
+
+    === Public Attributes ===
+    @type tree: FileSystemTree
+        The tree being kept up to date.
+    @type path: str
+        The path of the folder <tree> was scanned from.
+    @type overflowed: bool
+        Whether events were lost because the kernel's queue overflowed.
+
+    === Private Attributes ===
+    @type _follow_symlinks: bool
+    @type _disk_usage: bool
+    @type _options: dict[str, object]
+        The options the tree was scanned with; see FileSystemTree.__init__.
+    @type _fd: int
+        The inotify file descriptor.
+    @type _folders: dict[int, FileSystemTree]
+        The folder watched by each watch descriptor.
+    @type _children: dict[int, dict[str, FileSystemTree]]
+        The subtrees of the folder watched by each watch descriptor, by name.
+    @type _wds: dict[int, int]
+        The watch descriptor of each watched folder, by id.
+    """
+    def __init__(self, tree, path, follow_symlinks=True, disk_usage=False,
+                 **options):
+        """Start watching every folder of <tree>, which was scanned from the
+        folder <path> with the given options. <options> are the other
+        options <tree> was scanned with; new folders are scanned with them.
+
+        Raise ValueError if one of PRUNING_OPTIONS is set, and OSError if
+        inotify is not available.
+
+        @type self: TreeWatcher
+        @type tree: FileSystemTree
+        @type path: str
+        @type follow_symlinks: bool
+        @type disk_usage: bool
+        @rtype: None
+        """
+        for name in PRUNING_OPTIONS:
+            if options.get(name):
+                raise ValueError('cannot watch a tree scanned with '
+                                 '{}'.format(name))
+        if _LIBC is None:
+            raise OSError('inotify is not available on this system')
+        self.tree = tree
+        self.path = path
+        self.overflowed = False
+        self._follow_symlinks = follow_symlinks
+        self._disk_usage = disk_usage
+        self._options = options
+        self._fd = _LIBC.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._folders = {}
+        self._children = {}
+        self._wds = {}
+        self._watch_subtree(tree, path)
+
+    def fileno(self):
+        """Return the inotify file descriptor, which is readable when there
+        are events to apply.
+
+        @type self: TreeWatcher
+        @rtype: int
+        """
+        return self._fd
+
+    def close(self):
+        """Stop watching the tree.
+
+        @type self: TreeWatcher
+        @rtype: None
+        """
+        os.close(self._fd)
+
+    def update(self):
+        """Apply all the events that have arrived since the last update to
+        the tree, as a single batch. Return whether there were any.
+
+        @type self: TreeWatcher
+        @rtype: bool
+        """
+        events = self._read_events()
+        if len(events) == 0:
+            return False
+        with instrumentation.phase('watch'):
+            dirty = {}  # the leaves to stat again, by id
+            moved = {}  # the subtrees moved away, by cookie
+            for wd, mask, cookie, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    self.overflowed = True
+                elif mask & IN_IGNORED:  # the folder is no longer watched
+                    self._forget(wd)
+                elif wd not in self._folders:
+                    continue
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    subtree = self._detach(wd, name)
+                    if subtree is not None and mask & IN_MOVED_FROM:
+                        moved[cookie] = subtree
+                    elif subtree is not None:
+                        self._unwatch(subtree, False)
+                elif mask & IN_MOVED_TO and cookie in moved:
+                    subtree = moved.pop(cookie)
+                    subtree.rename(name)
+                    self._attach(wd, subtree)
+                elif mask & (IN_CREATE | IN_MOVED_TO) and mask & IN_ISDIR:
+                    self._attach_folder(wd, name)
+                elif mask & (IN_CREATE | IN_MOVED_TO):
+                    leaf = FileSystemTree.__new__(type(self.tree))
+                    AbstractTree.__init__(leaf, name, [], 0)
+                    self._attach(wd, leaf)
+                    dirty[id(leaf)] = leaf
+                elif mask & IN_MODIFY and name in self._children[wd]:
+                    leaf = self._children[wd][name]
+                    dirty[id(leaf)] = leaf
+            # Whatever was moved away without coming back left the tree.
+            for subtree in moved.values():
+                self._unwatch(subtree, True)
+            # The leaves are looked up again by their current path, so a file
+            # renamed after it was written is stat'ed under its new name.
+            for leaf in dirty.values():
+                self._resize(leaf)
+        instrumentation.count('watch_events', len(events))
+        return True
+
+    def remove(self, subtree):
+        """Remove <subtree> from the tree without deleting it from the disk,
+        e.g. when it is deleted in the visualiser, and stop watching it.
+
+        The entry is added back if it is created again. Other events about
+        it are ignored.
+
+        @type self: TreeWatcher
+        @type subtree: FileSystemTree
+        @rtype: None
+        """
+        wd = self._wds.get(id(subtree.get_parent()))
+        if wd is not None and \
+                self._children[wd].get(subtree.treename()) is subtree:
+            self._detach(wd, subtree.treename())
+        else:
+            subtree.detach()
+        self._unwatch(subtree, True)
+
+    def contains(self, subtree):
+        """Return whether <subtree> is still part of the tree.
+
+        @type self: TreeWatcher
+        @type subtree: AbstractTree
+        @rtype: bool
+        """
+        while subtree.get_parent() is not None:
+            subtree = subtree.get_parent()
+        return subtree is self.tree
+
+    def _read_events(self):
+        """Return the (wd, mask, cookie, name) of every event waiting to be
+        read, in order.
+
+        @type self: TreeWatcher
+        @rtype: list[(int, int, int, str)]
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self._fd, READ_SIZE)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = data[offset:offset + length].split(b'\0', 1)[0]
+                offset += length
+                events.append((wd, mask, cookie, os.fsdecode(name)))
+
+    def _watch_subtree(self, subtree, path):
+        """Watch every folder of <subtree>, which is at <path>.
+
+        @type self: TreeWatcher
+        @type subtree: FileSystemTree
+        @type path: str
+        @rtype: None
+        """
+        stack = [(subtree, path)]
+        while len(stack) != 0:
+            folder, folder_path = stack.pop()
+            # Only an empty folder can be a leaf of size 0, so other leaves
+            # need not be stat'ed.
+            if len(folder.subtrees()) == 0 and \
+                    (folder.data_size != 0 or not os.path.isdir(folder_path)):
+                continue
+            wd = _LIBC.inotify_add_watch(self._fd, os.fsencode(folder_path),
+                                         WATCH_MASK)
+            if wd < 0:  # e.g. no permission, or too many watches
+                continue
+            self._folders[wd] = folder
+            self._children[wd] = {child.treename(): child
+                                  for child in folder.subtrees()}
+            self._wds[id(folder)] = wd
+            for child in folder.subtrees():
+                stack.append((child, os.path.join(folder_path,
+                                                  child.treename())))
+
+    def _unwatch(self, subtree, remove):
+        """Stop tracking the folders of <subtree>, which left the tree. If
+        <remove> is True, their watches are also removed from the kernel
+        (which it does by itself for deleted folders).
+
+        @type self: TreeWatcher
+        @type subtree: FileSystemTree
+        @type remove: bool
+        @rtype: None
+        """
+        stack = [subtree]
+        while len(stack) != 0:
+            folder = stack.pop()
+            wd = self._wds.get(id(folder))
+            if wd is not None:
+                self._forget(wd)
+                if remove:
+                    _LIBC.inotify_rm_watch(self._fd, wd)
+            stack.extend(folder.subtrees())
+
+    def _forget(self, wd):
+        """Stop tracking the folder watched by <wd>, if any.
+
+        @type self: TreeWatcher
+        @type wd: int
+        @rtype: None
+        """
+        folder = self._folders.pop(wd, None)
+        if folder is not None:
+            del self._children[wd]
+            del self._wds[id(folder)]
+
+    def _path(self, subtree):
+        """Return the path of <subtree>, or None if it is no longer part of
+        the tree.
+
+        @type self: TreeWatcher
+        @type subtree: FileSystemTree
+        @rtype: str | None
+        """
+        names = []
+        while subtree is not self.tree:
+            if subtree is None:
+                return None
+            names.append(subtree.treename())
+            subtree = subtree.get_parent()
+        names.reverse()
+        return os.path.join(self.path, *names)
+
+    def _attach(self, wd, subtree):
+        """Splice <subtree> into the folder watched by <wd>, replacing the
+        entry of the same name if there is one.
+
+        @type self: TreeWatcher
+        @type wd: int
+        @type subtree: FileSystemTree
+        @rtype: None
+        """
+        replaced = self._detach(wd, subtree.treename())
+        if replaced is not None:
+            self._unwatch(replaced, True)
+        folder = self._folders[wd]
+        folder.subtrees().append(subtree)
+        subtree._parent_tree = folder
+        self._children[wd][subtree.treename()] = subtree
+        folder.data_size += subtree.data_size
+        folder.update_datasize(subtree.data_size, 0)
+
+    def _attach_folder(self, wd, name):
+        """Scan the new folder <name> of the folder watched by <wd>, and
+        splice it in.
+
+        The folder is watched before it is scanned, so the entries created
+        while it is being scanned are either scanned or reported in the next
+        batch (where they replace the scanned entry of the same name).
+
+        @type self: TreeWatcher
+        @type wd: int
+        @type name: str
+        @rtype: None
+        """
+        path = os.path.join(self._path(self._folders[wd]), name)
+        new_wd = _LIBC.inotify_add_watch(self._fd, os.fsencode(path),
+                                         WATCH_MASK)
+        try:
+            subtree = type(self.tree)(path, self._follow_symlinks,
+                                      disk_usage=self._disk_usage,
+                                      **self._options)
+        except OSError:  # it is already gone
+            if new_wd >= 0:
+                _LIBC.inotify_rm_watch(self._fd, new_wd)
+            return
+        self._attach(wd, subtree)
+        self._watch_subtree(subtree, path)
+
+    def _detach(self, wd, name):
+        """Remove the entry <name> from the folder watched by <wd>, and return
+        it, or None if there is no such entry.
+
+        @type self: TreeWatcher
+        @type wd: int
+        @type name: str
+        @rtype: FileSystemTree | None
+        """
+        subtree = self._children[wd].pop(name, None)
+        folder = self._folders[wd]
+        # An entry already removed from the tree (e.g. by the visualiser)
+        # has no parent any more.
+        if subtree is None or subtree.get_parent() is not folder:
+            return None
+        subtree.detach()
+        if len(folder.subtrees()) == 0:  # the folder is now drawn as a leaf
+            folder.color = (randint(0, 255), randint(0, 255), randint(0, 255))
+        return subtree
+
+    def _resize(self, leaf):
+        """Stat the file <leaf> again, and update its size.
+
+        @type self: TreeWatcher
+        @type leaf: FileSystemTree
+        @rtype: None
+        """
+        path = self._path(leaf)
+        # Gone, removed from the tree since, or a folder.
+        if path is None or id(leaf) in self._wds:
+            return
+        try:
+            info = os.stat(path, follow_symlinks=self._follow_symlinks)
+        except OSError:  # deleted since; its event is in the next batch
+            return
+        size = info.st_blocks * 512 if self._disk_usage else info.st_size
+        delta = size - leaf.data_size
+        leaf.data_size = size
+        leaf.update_datasize(delta, 0)
+
+
+if __name__ == '__main__':
+    import python_ta
+    # Remember to change this to check_all when cleaning up your code.
+    python_ta.check_errors(config='pylintrc.txt')